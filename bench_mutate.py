@@ -0,0 +1,207 @@
+import ast
+import glob
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import astor
+from mutate import (FunctionCounter, MutantPool, applyMutations, buildSiteTable, buildSpliceTable, cloneSpine,
+                    compiledKey, parseOptions, pickMutations, planMutants, spliceMutant, writeMutant)
+
+# in pipeline order. copy + mutate + unparse is how mutationChamber builds a mutant by default,
+# splice is what it does instead with --splice, tce is the --tce filter
+STAGES = ["parse", "sites", "plan", "copy", "mutate", "unparse", "splice", "dedup", "tce", "write"]
+ASTOR_PATH = ["copy", "mutate", "unparse", "dedup", "write"]
+SPLICE_PATH = ["splice", "dedup", "write"]
+
+
+def syntheticModule(num_funcs, seed=0):
+    """A module of num_funcs small functions shaped like fuzzywuzzy's: comparisons, arithmetic,
+    boolean constants, assignments and calls to each other, so every function has sites and most
+    get called often enough for planMutants to pick them."""
+    rng = random.Random(seed)
+    lines = []
+    for k in range(num_funcs):
+        callees = [rng.randrange(num_funcs) for _ in range(3)]
+        lines += ["def f%d(a, b):" % k,
+                  "    c = a + b * 2",
+                  "    if c >= b and a != 0 or False:",
+                  "        c = f%d(c - 1, b // 3)" % callees[0],
+                  "    d = [x for x in range(b) if x < a]",
+                  "    f%d(a, True)" % callees[1],
+                  "    return c == f%d(d, a) or c > 0" % callees[2],
+                  "", ""]
+    return "\n".join(lines)
+
+
+def corpora(synthetic_sizes):
+    "(name, [module sources as bytes]) for every corpus, smallest first."
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, "fuzzywuzzy.py"), "rb") as src:
+        yield "fuzzywuzzy", [src.read()]
+    # the astor that ships in env/, or whichever one we imported if that's not around
+    astor_dirs = glob.glob(os.path.join(here, "env", "lib", "python*", "site-packages", "astor"))
+    astor_dir = astor_dirs[0] if astor_dirs else os.path.dirname(astor.__file__)
+    sources = []
+    for path in sorted(glob.glob(os.path.join(astor_dir, "*.py"))):
+        with open(path, "rb") as src:
+            sources.append(src.read())
+    yield "astor", sources
+    for size in synthetic_sizes:
+        yield "synthetic-%d" % size, [syntheticModule(size).encode()]
+
+
+@contextmanager
+def stage(times, name):
+    start = time.perf_counter()
+    yield
+    times[name] += time.perf_counter() - start
+
+
+def benchModule(source, num_mutants, times, seed=0):
+    """Make num_mutants mutants of one module every way mutate.py can, adding the seconds each
+    stage took to times. The mutants are random one to three site picks (same ones every run for
+    the same seed), not planMutants', so every module gets the same number whatever its call graph
+    looks like; plan is timed on its own. Returns (sites, mutants made, mutants planMutants gave)."""
+    rng = random.Random(seed)
+    with stage(times, "parse"):
+        tree = ast.parse(source)
+    with stage(times, "sites"):
+        sites = buildSiteTable(tree)
+    if not sites:
+        return 0, 0, 0
+    with stage(times, "plan"):
+        ctr = FunctionCounter()
+        ctr.visit(tree)
+        treeData = ctr.getTreeData()
+        treeData["call_count"] = sorted(treeData["call_count"].items(), key=lambda x: x[1], reverse=True)
+        planned = len(list(planMutants(treeData, sites, num_mutants, seed)))
+    with stage(times, "splice"):
+        splice_table = buildSpliceTable(source, sites)
+    pool = MutantPool()
+    made = 0
+    for number in range(num_mutants):
+        mutations = pickMutations(sites, rng.sample(range(len(sites)), min(len(sites), rng.randint(1, 3))))
+        with stage(times, "dedup"):
+            if not pool.add(mutations):
+                continue
+        with stage(times, "copy"):
+            mutant = cloneSpine(tree, [sites[m.site_id].path for m in mutations])
+        with stage(times, "mutate"):
+            applyMutations(mutant, sites, mutations)
+        with stage(times, "unparse"):
+            mutant_src = astor.to_source(mutant)
+        with stage(times, "splice"):
+            spliceMutant(source, splice_table, mutations)
+        with stage(times, "tce"):
+            compiledKey(mutant_src)
+        with stage(times, "write"):
+            writeMutant(number, mutant_src)
+        made += 1
+    return len(sites), made, planned
+
+
+def benchCorpus(sources, num_mutants, repeats):
+    "benchModule over every module of a corpus, best of repeats for each stage."
+    best = None
+    for _ in range(repeats):
+        times = dict.fromkeys(STAGES, 0.0)
+        counts = [benchModule(source, num_mutants, times) for source in sources]
+        best = times if best is None else {name: min(best[name], times[name]) for name in STAGES}
+    sites, made, planned = (sum(column) for column in zip(*counts))
+    return {"modules": len(sources), "lines": sum(source.count(b"\n") for source in sources), "sites": sites,
+            "mutants": made, "planned": planned, "seconds": best,
+            "mutants_per_second": {"astor": made / max(sum(best[name] for name in ASTOR_PATH), 1e-9),
+                                   "splice": made / max(sum(best[name] for name in SPLICE_PATH), 1e-9)}}
+
+
+def compare(baseline, results, tolerance, noise=0.001):
+    """Lines saying how every stage moved since baseline; a stage more than tolerance slower (and
+    slower by more than noise seconds, below which it's all timer jitter) is a regression.
+    Returns (lines, number of regressions)."""
+    lines, regressions = [], 0
+    for corpus, result in results["corpora"].items():
+        old = baseline.get("corpora", {}).get(corpus)
+        if old is None:
+            lines.append("%-16s not in baseline" % corpus)
+            continue
+        if old["mutants"] != result["mutants"]:
+            lines.append("%-16s made %d mutants, baseline made %d, not comparable" % (corpus, result["mutants"], old["mutants"]))
+            continue
+        for name in STAGES:
+            before, after = old["seconds"][name], result["seconds"][name]
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            if change > tolerance and after - before > noise:
+                flag = "  REGRESSION"
+                regressions += 1
+            lines.append("%-16s %-8s %9.4fs -> %9.4fs %+7.1f%%%s" % (corpus, name, before, after, 100 * change, flag))
+    return lines, regressions
+
+
+def report(results):
+    for corpus, result in results["corpora"].items():
+        print("%s: %d modules, %d lines, %d sites, %d mutants (planMutants gave %d)" % (
+            corpus, result["modules"], result["lines"], result["sites"], result["mutants"], result["planned"]))
+        for name in STAGES:
+            seconds = result["seconds"][name]
+            print("  %-8s %9.4fs %9.1fus/mutant" % (name, seconds, 1e6 * seconds / max(result["mutants"], 1)))
+        print("  mutants/s: %.1f through astor, %.1f spliced" % (
+            result["mutants_per_second"]["astor"], result["mutants_per_second"]["splice"]))
+
+
+def main(args):
+    args, options = parseOptions(args)
+    if len(args) != 1:
+        printUsage()
+        return
+    num_mutants = int(options.get("mutants", 20))
+    repeats = int(options.get("repeats", 3))
+    sizes = [int(size) for size in str(options.get("synthetic", "1000,3000")).split(",") if size]
+    baseline_path = options.get("baseline", "bench_baseline.json")
+    results = {"python": platform.python_version(), "mutants": num_mutants, "repeats": repeats, "corpora": {}}
+    # writeMutant writes to the current directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            for name, sources in corpora(sizes):
+                results["corpora"][name] = benchCorpus(sources, num_mutants, repeats)
+        finally:
+            os.chdir(cwd)
+    report(results)
+    if options.get("compare"):
+        with open(baseline_path) as src:
+            baseline = json.load(src)
+        lines, regressions = compare(baseline, results, float(options.get("tolerance", 0.2)))
+        print("\n".join(lines))
+        if baseline.get("python") != results["python"]:
+            print("baseline is from Python %s, this is %s" % (baseline.get("python"), results["python"]))
+        print("%d regressions" % regressions)
+        if regressions:
+            sys.exit(1)
+    if options.get("save"):
+        with open(baseline_path, "w") as out:
+            json.dump(results, out, indent=1)
+        print("Saved to", baseline_path)
+
+
+def printUsage():
+    print("USAGE: bench_mutate.py [--mutants=N] [--repeats=N] [--synthetic=SIZES] [--save] [--compare]")
+    print("                       [--baseline=FILE] [--tolerance=F]")
+    print("  --mutants    mutants per module (default 20; astor.to_source on the big synthetic modules takes most of a second each)")
+    print("  --repeats    runs per corpus, each stage keeps its best (default 3)")
+    print("  --synthetic  comma separated function counts of the synthetic modules (default 1000,3000)")
+    print("  --save       write the results to the baseline file")
+    print("  --compare    compare against the baseline file, exit 1 if a stage got more than --tolerance slower")
+    print("  --baseline   default bench_baseline.json")
+    print("  --tolerance  fraction a stage may slow down before it counts as a regression (default 0.2)")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
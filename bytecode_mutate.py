@@ -0,0 +1,162 @@
+import dis
+import inspect
+import json
+import os
+import sys
+import types
+from collections import namedtuple
+
+# One mutable instruction. path is the chain of co_consts indices from the module's code object
+# down to the code object holding it, offset is where it sits in that code's co_code, kind is
+# the ast node MutationChamber would have touched for the same mutation, func is co_name, and
+# opcode/arg/const are what the instruction becomes (const is a value to add to co_consts first,
+# when the new arg needs one that isn't there yet).
+BytecodeSite = namedtuple("BytecodeSite", ["path", "offset", "kind", "func", "line", "original", "replacement",
+                                           "opcode", "arg", "const"])
+
+# same swaps as MutationChamber.visit_Compare and visit_BinOp, by source symbol
+COMPARE_SWAPS = {">=": "<", ">": "<=", "<=": ">", "<": ">=", "==": "!=", "!=": "=="}
+BINARY_SWAPS = {"+": "-", "-": "+", "*": "//", "//": "*"}
+
+# branch polarity: visit_BoolOp's and <-> or where the interpreter still has a dedicated
+# opcode for it (3.11), plus plain conditional jumps, which is what negating an if test does
+JUMP_SWAPS = {
+    "JUMP_IF_FALSE_OR_POP": "JUMP_IF_TRUE_OR_POP", "JUMP_IF_TRUE_OR_POP": "JUMP_IF_FALSE_OR_POP",
+    "POP_JUMP_IF_FALSE": "POP_JUMP_IF_TRUE", "POP_JUMP_IF_TRUE": "POP_JUMP_IF_FALSE",
+    "POP_JUMP_FORWARD_IF_FALSE": "POP_JUMP_FORWARD_IF_TRUE", "POP_JUMP_FORWARD_IF_TRUE": "POP_JUMP_FORWARD_IF_FALSE",
+    "POP_JUMP_BACKWARD_IF_FALSE": "POP_JUMP_BACKWARD_IF_TRUE", "POP_JUMP_BACKWARD_IF_TRUE": "POP_JUMP_BACKWARD_IF_FALSE",
+}
+# before 3.11 every binary operator had its own opcode
+LEGACY_BINARY_SWAPS = {"BINARY_ADD": "BINARY_SUBTRACT", "BINARY_SUBTRACT": "BINARY_ADD",
+                       "BINARY_MULTIPLY": "BINARY_FLOOR_DIVIDE", "BINARY_FLOOR_DIVIDE": "BINARY_MULTIPLY"}
+
+
+def probeArgs(opname, symbols):
+    """How this interpreter encodes each operator as the arg of opname, found by compiling
+    a op b and looking. Saves hardcoding a table that changes every Python release."""
+    args = {}
+    for symbol in symbols:
+        for ins in dis.get_instructions(compile("a %s b" % symbol, "<probe>", "eval")):
+            if ins.opname == opname:
+                args[symbol] = ins.arg
+    return args
+
+
+COMPARE_ARGS = probeArgs("COMPARE_OP", COMPARE_SWAPS)
+BINARY_ARGS = probeArgs("BINARY_OP", BINARY_SWAPS)
+BINARY_SYMBOLS = {arg: symbol for symbol, arg in BINARY_ARGS.items()}
+
+
+def compareSymbol(ins):
+    "'<' for a COMPARE_OP, whatever extra flags newer Pythons fold into its argval."
+    symbol = str(ins.argval)
+    if symbol.startswith("bool(") and symbol.endswith(")"):
+        symbol = symbol[5:-1]
+    return symbol
+
+
+def findBytecodeSites(code, path=()):
+    """Every instruction we know how to mutate, in code and every code object nested in it.
+    Like SiteIndexer, only code that runs inside a function counts, so module and class bodies
+    (and with them default arguments) are left alone."""
+    sites = []
+    if code.co_flags & inspect.CO_OPTIMIZED:
+        instructions = list(dis.get_instructions(code))
+        for n, ins in enumerate(instructions):
+            # arg bytes only: anything that needed EXTENDED_ARG is left alone
+            if ins.arg is None or ins.arg > 255 or (n and instructions[n - 1].opname == "EXTENDED_ARG"):
+                continue
+            line = ins.positions.lineno if hasattr(ins, "positions") else ins.starts_line
+            site = None
+            if ins.opname == "COMPARE_OP" and compareSymbol(ins) in COMPARE_SWAPS:
+                original = compareSymbol(ins)
+                replacement = COMPARE_SWAPS[original]
+                arg = ins.arg - COMPARE_ARGS[original] + COMPARE_ARGS[replacement]
+                site = ("Compare", original, replacement, ins.opcode, arg, None)
+            elif ins.opname == "BINARY_OP" and ins.arg in BINARY_SYMBOLS:
+                original = BINARY_SYMBOLS[ins.arg]
+                replacement = BINARY_SWAPS[original]
+                site = ("BinOp", original, replacement, ins.opcode, BINARY_ARGS[replacement], None)
+            elif ins.opname in LEGACY_BINARY_SWAPS and LEGACY_BINARY_SWAPS[ins.opname] in dis.opmap:
+                replacement = LEGACY_BINARY_SWAPS[ins.opname]
+                site = ("BinOp", ins.opname, replacement, dis.opmap[replacement], ins.arg, None)
+            elif ins.opname in ("LOAD_CONST", "RETURN_CONST") and (ins.argval is True or ins.argval is False):
+                flipped = not ins.argval
+                # 'is', not 'in': 1 == True, and 1 may well come first in co_consts
+                existing = [i for i, const in enumerate(code.co_consts) if const is flipped]
+                arg = existing[0] if existing else len(code.co_consts)
+                if arg <= 255:
+                    site = ("Constant", str(ins.argval), str(flipped), ins.opcode, arg, None if existing else flipped)
+            elif ins.opname in JUMP_SWAPS and JUMP_SWAPS[ins.opname] in dis.opmap:
+                replacement = JUMP_SWAPS[ins.opname]
+                kind = "BoolOp" if ins.opname.endswith("_OR_POP") else "If"
+                site = (kind, ins.opname, replacement, dis.opmap[replacement], ins.arg, None)
+            if site:
+                kind, original, replacement, opcode, arg, const = site
+                sites.append(BytecodeSite(path, ins.offset, kind, code.co_name, line, original, replacement, opcode, arg, const))
+    for i, const in enumerate(code.co_consts):
+        if isinstance(const, types.CodeType):
+            sites.extend(findBytecodeSites(const, path + (i,)))
+    return sites
+
+
+def patchCode(code, site):
+    raw = bytearray(code.co_code)
+    raw[site.offset] = site.opcode
+    raw[site.offset + 1] = site.arg
+    consts = code.co_consts
+    if site.const is not None and site.arg >= len(consts):
+        consts = consts + (site.const,) * (site.arg + 1 - len(consts))
+    return code.replace(co_code=bytes(raw), co_consts=consts)
+
+
+def applyBytecodeMutations(code, sites):
+    """A mutated copy of the module code object. Only the code objects on the way down to each
+    mutated instruction are rebuilt, with CodeType.replace; everything else is shared."""
+    for site in sites:
+        code = rebuild(code, site.path, site)
+    return code
+
+
+def rebuild(code, path, site):
+    if not path:
+        return patchCode(code, site)
+    consts = list(code.co_consts)
+    consts[path[0]] = rebuild(consts[path[0]], path[1:], site)
+    return code.replace(co_consts=tuple(consts))
+
+
+def main(args):
+    """Run every first-order bytecode mutant of the target against the tests. Straight from the
+    compiled code object: no ast.parse, no deepcopy, no astor, no compile per mutant."""
+    from mutate import parseOptions
+    from mutant_runner import ForkServer, loadTestCode, runMutant, KILLED
+    args, options = parseOptions(args)
+    if len(args) != 3:
+        printUsage()
+        return
+    target_path, test_path = os.path.abspath(args[1]), args[2]
+    with open(target_path, "rb") as src:
+        module_code = compile(src.read(), target_path, "exec")
+    sites = findBytecodeSites(module_code)
+    if options.get("fork"):
+        run = ForkServer(target_path, test_path, timeout=float(options.get("timeout", 30))).run
+    else:
+        test_code = loadTestCode(test_path)
+        run = lambda mutant, name: runMutant(mutant, target_path, test_code, name)
+    killed = 0
+    for n, site in enumerate(sites):
+        result = run(applyBytecodeMutations(module_code, [site]), "bytecode:%d" % n)
+        result["mutation"] = {"func": site.func, "kind": site.kind, "line": site.line,
+                              "original": site.original, "replacement": site.replacement}
+        killed += result["status"] == KILLED
+        print(json.dumps(result))
+    print("Killed %d of %d bytecode mutants" % (killed, len(sites)), file=sys.stderr)
+
+
+def printUsage():
+    print("USAGE: bytecode_mutate.py <target file> <test file> [--fork] [--timeout=S]")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,377 @@
+import ast
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from itertools import chain, islice
+
+from mutant_runner import CRASH, KILLED, TIMEOUT, ForkServer, loadTestCode, runMutant, timeBudgets
+
+# The coordinator and its workers talk JSON over plain TCP, one object per line. A worker says
+# hello and gets back the target and test file (so a worker box needs nothing but this script
+# and the coordinator's address), then loops: lease -> mutant, wait or done; run it; result -> ok.
+# heartbeat goes one way, every HEARTBEAT seconds from a thread of its own, and gets no answer.
+# A worker the coordinator hasn't heard from in LEASE_TIMEOUT seconds, or that hung up, loses its
+# lease and the mutant goes to the next worker that asks; one that has lost MAX_ATTEMPTS workers
+# is written down as a crash. Heartbeats only say the worker is alive, not that the mutant is
+# getting anywhere (a --no-fork worker stuck in a looping mutant keeps beating forever), so a mutant
+# nobody has sent back within its timeout plus LEASE_SLACK seconds is written down as a timeout.
+# Either way a run always finishes.
+HEARTBEAT = 2.0
+LEASE_TIMEOUT = 10.0
+LEASE_SLACK = 30.0
+MAX_ATTEMPTS = 3
+
+
+def send(out, message):
+    out.write((json.dumps(message) + "\n").encode())
+    out.flush()
+
+
+def receive(src):
+    "The next message, or None once the other end has hung up."
+    line = src.readline()
+    return json.loads(line) if line else None
+
+
+class Coordinator:
+    """Hands out mutants to whoever asks and collects what comes back. mutants is what
+    mutate.generateMutants yields; a feeder thread pulls them into a short queue, so a mutant
+    is only built just before some worker wants it, and only kept until its result is in.
+    lease_limit is how long any one lease may last, heartbeats or not."""
+
+    def __init__(self, mutants, setup, ahead=16, lease_timeout=LEASE_TIMEOUT, max_attempts=MAX_ATTEMPTS,
+                 lease_limit=None):
+        self.setup = setup
+        self.lease_timeout = lease_timeout
+        self.lease_limit = lease_limit if lease_limit is not None else setup["timeout"] + LEASE_SLACK
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.ready = queue.Queue(ahead)
+        self.requeued = deque()
+        self.outstanding = {}   # id -> (name, source, description), leased or requeued
+        self.leases = {}        # id -> worker
+        self.leased_at = {}
+        self.attempts = {}
+        self.last_seen = {}
+        self.results = {}
+        self.descriptions = {}
+        self.fed = False        # the feeder has put every mutant in ready
+        self.generated = False  # ... and they've all been taken out again
+        self.taking = 0         # leases between taking a mutant off ready and putting it in outstanding
+        self.finished = threading.Event()
+        threading.Thread(target=self.feed, args=(mutants,), daemon=True).start()
+
+    def feed(self, mutants):
+        try:
+            for number, mutant_src, description in mutants:
+                self.ready.put((number, "%d.py" % number, mutant_src, description))
+        finally:
+            # if generating blew up (the traceback's on stderr), finish with what there is
+            with self.lock:
+                self.fed = True
+                self.checkFinished()
+
+    def seen(self, worker):
+        with self.lock:
+            self.last_seen[worker] = time.monotonic()
+
+    def lease(self, worker):
+        "The reply to a lease from worker."
+        with self.lock:
+            self.last_seen[worker] = time.monotonic()
+            if self.requeued:
+                return self.leaseTo(worker, self.requeued.popleft())
+            if self.generated:
+                return {"op": "wait"} if self.leases or self.requeued else {"op": "done"}
+            self.taking += 1
+        # outside the lock: the feeder may still be building it
+        try:
+            item = self.ready.get(timeout=1)
+        except queue.Empty:
+            with self.lock:
+                self.taking -= 1
+                self.checkFinished()
+                return {"op": "done"} if self.generated and not (self.leases or self.requeued) else {"op": "wait"}
+        with self.lock:
+            self.taking -= 1
+            number, name, mutant_src, description = item
+            self.outstanding[number] = (name, mutant_src, description)
+            self.descriptions[number] = description
+            return self.leaseTo(worker, number)
+
+    def leaseTo(self, worker, number):
+        name, mutant_src, _ = self.outstanding[number]
+        self.leases[number] = worker
+        self.leased_at[number] = time.monotonic()
+        self.attempts[number] = self.attempts.get(number, 0) + 1
+        return {"op": "mutant", "id": number, "name": name, "source": mutant_src}
+
+    def result(self, worker, number, result):
+        "Returns the result if it's the first one in for that mutant, None if it's a late duplicate."
+        with self.lock:
+            self.last_seen[worker] = time.monotonic()
+            if number in self.results or number not in self.outstanding:
+                return None
+            # a worker we'd given up on can still beat the one it was re-leased to
+            if number in self.requeued:
+                self.requeued.remove(number)
+            self.leases.pop(number, None)
+            self.outstanding.pop(number)
+            result["mutations"] = self.descriptions[number]["mutations"]
+            self.results[number] = result
+            self.checkFinished()
+            return result
+
+    def release(self, worker, reason):
+        "Take back every lease worker holds."
+        with self.lock:
+            self.last_seen.pop(worker, None)
+            for number in [number for number, holder in self.leases.items() if holder == worker]:
+                del self.leases[number]
+                name, _, description = self.outstanding[number]
+                if self.attempts[number] >= self.max_attempts:
+                    del self.outstanding[number]
+                    self.results[number] = {"mutant": name, "status": CRASH, "tests_run": 0, "failures": [], "errors": [],
+                                            "error": "lost %d workers, the last one because it %s" % (self.attempts[number], reason),
+                                            "mutations": description["mutations"]}
+                    print("%s %s, giving up on %s" % (worker, reason, name), file=sys.stderr)
+                else:
+                    self.requeued.append(number)
+                    print("%s %s, %s goes to the next worker" % (worker, reason, name), file=sys.stderr)
+            self.checkFinished()
+
+    def reap(self):
+        """release every worker that's gone quiet for longer than lease_timeout, and time out
+        every mutant that's been out for longer than lease_limit."""
+        now = time.monotonic()
+        with self.lock:
+            quiet = [worker for worker in set(self.leases.values())
+                     if now - self.last_seen.get(worker, 0) > self.lease_timeout]
+            for number in [number for number in self.leases if now - self.leased_at[number] > self.lease_limit]:
+                worker = self.leases.pop(number)
+                name, _, description = self.outstanding.pop(number)
+                # whatever the worker sends back now is a late duplicate
+                self.results[number] = {"mutant": name, "status": TIMEOUT, "tests_run": 0, "failures": [], "errors": [],
+                                        "error": "%s had it for more than %g seconds" % (worker, self.lease_limit),
+                                        "mutations": description["mutations"]}
+                print("%s has had %s for more than %g seconds, calling it a timeout" % (worker, name, self.lease_limit),
+                      file=sys.stderr)
+            self.checkFinished()
+        for worker in quiet:
+            self.release(worker, "went quiet")
+
+    def checkFinished(self):
+        # nothing takes from ready but lease, so once the feeder is done empty stays empty
+        if self.fed and not self.taking and self.ready.empty():
+            self.generated = True
+        if self.generated and not self.outstanding:
+            self.finished.set()
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    "One worker connection; self.server.coordinator does the bookkeeping."
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        worker = "%s:%d" % self.client_address
+        reason = "hung up"
+        try:
+            for message in iter(lambda: receive(self.rfile), None):
+                if message["op"] == "hello":
+                    worker = "%s/%s:%d" % ((message.get("worker"),) + self.client_address)
+                    coordinator.seen(worker)
+                    send(self.wfile, dict(coordinator.setup, op="setup"))
+                elif message["op"] == "heartbeat":
+                    coordinator.seen(worker)
+                elif message["op"] == "lease":
+                    send(self.wfile, coordinator.lease(worker))
+                elif message["op"] == "result":
+                    result = coordinator.result(worker, message["id"], message["result"])
+                    if result is not None:
+                        self.server.report(result)
+                    send(self.wfile, {"op": "ok"})
+        except OSError as e:
+            reason = "hung up (%s)" % e
+        except (ValueError, KeyError) as e:
+            reason = "broke the protocol (%s: %s)" % (type(e).__name__, e)
+        finally:
+            coordinator.release(worker, reason)
+
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, coordinator, report):
+        socketserver.ThreadingTCPServer.__init__(self, address, WorkerHandler)
+        self.coordinator = coordinator
+        self.report = report
+
+
+def killMatrix(results):
+    """One row per mutant, one column per test: 1 if the test killed it, 0 if it passed,
+    None if it never ran (cut short by a timeout or a crash, or left out by the runner)."""
+    tests = sorted({test for result in results.values() for test in result.get("ran", [])})
+    mutants, kills = [], []
+    for number in sorted(results):
+        result = results[number]
+        killed_by = set(result["failures"]) | set(result["errors"])
+        ran = set(result.get("ran", []))
+        mutants.append({"name": result["mutant"], "status": result["status"], "mutations": result.get("mutations")})
+        kills.append([1 if test in killed_by else 0 if test in ran else None for test in tests])
+    return {"tests": tests, "mutants": mutants, "kills": kills}
+
+
+def coordinate(target_path, test_path, num_mutants, host="", port=0, splice=False, seed=None, tce=False,
+               plan="calls", timeout=30.0, max_memory=1024 * 1024 * 1024, lease_timeout=LEASE_TIMEOUT,
+               jobs=1, out=sys.stdout):
+    """Serve num_mutants mutants of the target to workers until every one has a result, printing
+    each result to out as it comes in. Returns {mutant number: result}. Past a dozen or so workers
+    it's generating the mutants that holds them up, not the protocol; jobs is generateMutants'."""
+    from mutate import generateMutants
+    with open(target_path, "rb") as src:
+        source = src.read()
+    with open(test_path, "rb") as src:
+        test_source = src.read()
+    setup = {"target_name": os.path.basename(target_path), "target": source.decode("utf-8"),
+             "test_name": os.path.basename(test_path), "test": test_source.decode("utf-8"),
+             "timeout": timeout, "max_memory": max_memory}
+    mutants = generateMutants(ast.parse(source), num_mutants, source if splice else None, jobs=jobs,
+                              seed=num_mutants if seed is None else seed, tce=tce, out=sys.stderr, plan=plan)
+    # the first one now, so generateMutants' pool (if any) is forked before there are threads to copy
+    mutants = chain(list(islice(mutants, 1)), mutants)
+    coordinator = Coordinator(mutants, setup, ahead=16 * jobs, lease_timeout=lease_timeout)
+    report_lock = threading.Lock()
+
+    def report(result):
+        with report_lock:
+            print(json.dumps(result), file=out, flush=True)
+    server = CoordinatorServer((host, port), coordinator, report)
+    print("Coordinator listening on %s:%d" % server.server_address[:2], file=sys.stderr, flush=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        while not coordinator.finished.wait(1):
+            coordinator.reap()
+    finally:
+        server.shutdown()
+        server.server_close()
+    return coordinator.results
+
+
+def work(host, port, name=None, fork=True, budget=None, budget_floor=0.5, repeats=3):
+    """Run mutants for the coordinator at host:port until it says there are none left (or goes
+    away). Returns how many this worker ran. Each mutant gets a forked child unless fork is off,
+    and a budget turns it back on: an overrun budget can only be stopped from outside."""
+    connection = socket.create_connection((host, port))
+    src, out = connection.makefile("rb"), connection.makefile("wb")
+    send_lock = threading.Lock()
+
+    def talk(message):
+        with send_lock:
+            send(out, message)
+    talk({"op": "hello", "worker": name or "%s-%d" % (socket.gethostname(), os.getpid())})
+    setup = receive(src)
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(HEARTBEAT):
+            try:
+                talk({"op": "heartbeat"})
+            except OSError:
+                return
+    ran = 0
+    with tempfile.TemporaryDirectory() as scratch:
+        target_path, test_path = os.path.join(scratch, setup["target_name"]), os.path.join(scratch, setup["test_name"])
+        for path, text in ((target_path, setup["target"]), (test_path, setup["test"])):
+            with open(path, "w") as copy:
+                copy.write(text)
+        # budgets from this machine's own timings, the coordinator's may be nothing like it
+        budgets = timeBudgets(target_path, test_path, budget, budget_floor, repeats) if budget else None
+        if fork or budgets:
+            run = ForkServer(target_path, test_path, setup["timeout"], setup["max_memory"], budgets=budgets).run
+        else:
+            test_code = loadTestCode(test_path)
+            run = lambda mutant, name: runMutant(mutant, target_path, test_code, name, budgets=budgets)
+        threading.Thread(target=beat, daemon=True).start()
+        try:
+            while True:
+                talk({"op": "lease"})
+                reply = receive(src)
+                if reply is None or reply["op"] == "done":
+                    break
+                if reply["op"] == "wait":
+                    time.sleep(0.2)
+                    continue
+                result = run(reply["source"], reply["name"])
+                talk({"op": "result", "id": reply["id"], "result": result})
+                receive(src)
+                ran += 1
+        except OSError:
+            pass    # the coordinator went away, nothing left to do for it
+        finally:
+            stopped.set()
+            connection.close()
+    return ran
+
+
+def workerProcess(host, port, options):
+    work(host, port, fork=not options.get("no-fork"), budget=float(options["budget"]) if options.get("budget") else None,
+         budget_floor=float(options.get("budget-floor", 0.5)), repeats=int(options.get("repeats", 3)))
+
+
+def main(args):
+    from mutate import parseOptions, planOption
+    args, options = parseOptions(args)
+    if len(args) == 4 and args[1] == "coordinate" and options.get("generate"):
+        results = coordinate(os.path.abspath(args[2]), args[3], int(options["generate"]), options.get("host", ""),
+                             int(options.get("port", 0)), bool(options.get("splice")),
+                             int(options["seed"]) if "seed" in options else None, bool(options.get("tce")),
+                             planOption(options), float(options.get("timeout", 30)),
+                             int(options.get("max-memory", 1024)) * 1024 * 1024,
+                             float(options.get("lease-timeout", LEASE_TIMEOUT)), int(options.get("jobs", 1)))
+        with open(options.get("matrix", "kill_matrix.json"), "w") as out:
+            json.dump(killMatrix(results), out)
+        killed = sum(result["status"] == KILLED for result in results.values())
+        print("Killed %d of %d mutants" % (killed, len(results)), file=sys.stderr)
+    elif len(args) == 3 and args[1] == "work":
+        host, _, port = args[2].rpartition(":")
+        processes = [multiprocessing.Process(target=workerProcess, args=(host or "localhost", int(port), options))
+                     for _ in range(int(options.get("workers", 1)))]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    else:
+        printUsage()
+
+
+def printUsage():
+    print("USAGE: mutant_farm.py coordinate <target file> <test file> --generate=N [--host=H] [--port=P] [--matrix=FILE]")
+    print("                     [--splice] [--seed=S] [--tce] [--exhaustive | --stratified]")
+    print("                     [--timeout=S] [--max-memory=MB] [--lease-timeout=S] [--jobs=N]")
+    print("       mutant_farm.py work <host:port> [--workers=N] [--no-fork] [--budget=F] [--budget-floor=S] [--repeats=N]")
+    print("  coordinate  generate N mutants and hand them out to whatever workers connect, one at a time, until")
+    print("              every one has a result; results print as they come, the kill matrix goes to --matrix")
+    print("              (default kill_matrix.json). --port defaults to any free one, it's printed at startup")
+    print("  work        run mutants for the coordinator at host:port with N processes (default 1); the target")
+    print("              and test file come from the coordinator. Each mutant runs in a forked child, as with")
+    print("              mutant_runner.py --fork; --budget and the rest are as there, --timeout and --max-memory")
+    print("              are the coordinator's to set")
+    print("  --no-fork   run mutants in the worker process itself: quicker, but a mutant that hangs takes the")
+    print("              worker with it. Ignored with --budget")
+    print("  --timeout   seconds a mutant gets in a worker (default 30); any worker that hasn't sent one back")
+    print("              %g seconds after that has it written down as a timeout, so keep --budget workers' budgets under it" % LEASE_SLACK)
+    print("  --lease-timeout  seconds without a heartbeat before a worker's mutant goes to someone else (default %g)" % LEASE_TIMEOUT)
+    print("  --jobs      processes the coordinator builds mutants with; one keeps up with about a dozen workers")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,1001 @@
+import ast
+import copy
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import queue
+import select
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import types
+import unittest
+from itertools import islice
+
+KILLED, SURVIVED, TIMEOUT, CRASH = "killed", "survived", "timeout", "crash"
+
+
+def isUnittestMain(stmt):
+    "The unittest.main() the public test files end with, which would run everything the moment we load them."
+    return (isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Call)
+            and isinstance(stmt.value.func, ast.Attribute) and stmt.value.func.attr == "main"
+            and isinstance(stmt.value.func.value, ast.Name) and stmt.value.func.value.id == "unittest")
+
+
+def loadTestCode(test_path):
+    "Compile the test file once, minus its unittest.main()."
+    with open(test_path, "rb") as src:
+        tree = ast.parse(src.read())
+    tree.body = [stmt for stmt in tree.body if not isUnittestMain(stmt)]
+    return compile(tree, os.path.abspath(test_path), "exec")
+
+
+def moduleName(target_path):
+    return os.path.splitext(os.path.basename(target_path))[0]
+
+
+def installModule(name, code, path):
+    "Run code as a brand new module called name and make it what 'import name' finds."
+    module = types.ModuleType(name)
+    module.__file__ = path
+    sys.modules[name] = module
+    exec(code, module.__dict__)
+    return module
+
+
+def execTests(test_code):
+    "Run the compiled test file as a fresh module, so it imports whatever is in sys.modules now."
+    module = types.ModuleType(moduleName(test_code.co_filename))
+    module.__file__ = test_code.co_filename
+    exec(test_code, module.__dict__)
+    return module
+
+
+def loadTests(test_code):
+    "execTests and collect its tests."
+    return unittest.defaultTestLoader.loadTestsFromModule(execTests(test_code))
+
+
+class OverBudget(BaseException):
+    """Raised (by SIGALRM) in a test that ran past its time budget. Not an Exception, so only a bare
+    except or an except BaseException in the mutant or the tests swallows it; that's why --budget
+    always forks, and the child's own timeout catches those."""
+
+
+class RecordingResult(unittest.TestResult):
+    """A TestResult that also remembers which tests actually got to run, in order, and how long each took.
+    With budgets ({test id: seconds}) each test gets an alarm that long; over_budget is the first one
+    that ran past it, which also ends the run."""
+    def __init__(self, budgets=None):
+        super().__init__()
+        self.ran = []
+        self.times = {}
+        self.started = None
+        self.budgets = budgets
+        self.over_budget = None
+
+    def startTest(self, test):
+        super().startTest(test)
+        self.ran.append(test.id())
+        self.started = time.perf_counter()
+        if self.budgets and test.id() in self.budgets:
+            signal.setitimer(signal.ITIMER_REAL, self.budgets[test.id()])
+
+    def stopTest(self, test):
+        if self.budgets:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        self.times[test.id()] = time.perf_counter() - self.started
+        super().stopTest(test)
+
+    def addError(self, test, err):
+        # unittest catches everything a test raises, OverBudget too, and would call it an error
+        if err[0] is OverBudget:
+            self.over_budget = test.id()
+            self.stop()
+        else:
+            super().addError(test, err)
+
+
+def flattenSuite(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from flattenSuite(test)
+        else:
+            yield test
+
+
+def overBudget(signum, frame):
+    raise OverBudget()
+
+
+def runSuite(suite, order=None, fail_fast=False, only=None, budgets=None):
+    """Run suite quietly and hand back the (Recording)TestResult. order is a list of test ids
+    to run first, in that order; with fail_fast the run stops at the first failure or error.
+    If only is given, tests whose id isn't in it are skipped altogether. budgets is per test
+    time limits, see RecordingResult; needs the main thread, since it goes through SIGALRM."""
+    if order or only is not None:
+        rank = {test_id: i for i, test_id in enumerate(order or ())}
+        tests = [test for test in flattenSuite(suite) if only is None or test.id() in only]
+        suite = unittest.TestSuite(sorted(tests, key=lambda test: rank.get(test.id(), len(rank))))
+    result = RecordingResult(budgets)
+    result.failfast = fail_fast
+    if not budgets:
+        suite.run(result)
+        return result
+    previous = signal.signal(signal.SIGALRM, overBudget)
+    try:
+        suite.run(result)
+    except OverBudget:
+        # went off outside the test itself, in a tearDown or in the result bookkeeping
+        result.over_budget = result.ran[-1]
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+    return result
+
+
+def timeBudgets(target_path, test_path, factor=10.0, floor=0.5, repeats=3):
+    """{test id: seconds} a test may take against a mutant: factor times what it takes against the
+    real target (the median of repeats runs, the first of which pays for warming up), but never
+    less than floor, so a test that normally takes a millisecond isn't failed by a GC pause."""
+    target_path = os.path.abspath(target_path)
+    test_code = loadTestCode(test_path)
+    with open(target_path, "rb") as src:
+        target_code = compile(src.read(), target_path, "exec")
+    saved = sys.modules.get(moduleName(target_path))
+    installModule(moduleName(target_path), target_code, target_path)
+    runs = [runSuite(loadTests(test_code)).times for _ in range(repeats)]
+    if saved is not None:
+        sys.modules[moduleName(target_path)] = saved
+    return {test_id: max(floor, factor * sorted(run[test_id] for run in runs)[len(runs) // 2]) for test_id in runs[0]}
+
+
+class KillStats:
+    """How often each test has killed a mutant of each function, and how often it got the
+    chance to, kept in a JSON file between runs. Used to put the likeliest killers first."""
+    def __init__(self, path):
+        self.path = path
+        self.stats = {}
+        if os.path.exists(path):
+            with open(path) as src:
+                self.stats = json.load(src)
+
+    def killProbability(self, funcs, test_id):
+        kills, runs = 0, 0
+        for func in funcs:
+            k, r = self.stats.get(func, {}).get(test_id, (0, 0))
+            kills, runs = kills + k, runs + r
+        # Laplace smoothing, so a test that never ran yet sits in the middle and not at the bottom
+        return (kills + 1) / (runs + 2)
+
+    def order(self, funcs, test_ids):
+        "test_ids sorted likeliest killer first, ties keep the order they came in."
+        return sorted(test_ids, key=lambda test_id: -self.killProbability(funcs, test_id))
+
+    def record(self, funcs, result):
+        killers = set(result["failures"]) | set(result["errors"])
+        for func in funcs:
+            func_stats = self.stats.setdefault(func, {})
+            for test_id in result.get("ran", ()):
+                k, r = func_stats.get(test_id, (0, 0))
+                func_stats[test_id] = (k + (test_id in killers), r + 1)
+
+    def save(self):
+        with open(self.path, "w") as out:
+            json.dump(self.stats, out, indent=1)
+
+
+def testHashes(test_path):
+    """{test id: hash of its source} for every test method in the test file. setUp and tearDown
+    go into the hash of every test in their class, since editing them changes what the test does.
+    Hashes the ast, so comments and formatting don't count as edits."""
+    with open(test_path, "rb") as src:
+        tree = ast.parse(src.read())
+    hashes = {}
+    for cls in tree.body:
+        if not isinstance(cls, ast.ClassDef):
+            continue
+        methods = [node for node in cls.body if isinstance(node, ast.FunctionDef)]
+        fixture = "".join(ast.dump(node) for node in methods if node.name in ("setUp", "tearDown"))
+        for method in methods:
+            if method.name.startswith("test"):
+                test_id = "%s.%s.%s" % (moduleName(test_path), cls.name, method.name)
+                hashes[test_id] = hashlib.sha1((fixture + ast.dump(method)).encode()).hexdigest()[:16]
+    return hashes
+
+
+def mutantKey(mutations):
+    "The result store's name for a mutant, from its mutations.json entries. None if one has no key."
+    keys = [mutation.get("key") for mutation in mutations]
+    return "|".join(sorted(keys)) if keys and None not in keys else None
+
+
+class ResultStore:
+    """Every (mutant, test) outcome we have seen, in SQLite, so the next run only has to redo what
+    an edit could have changed. A mutant is named by mutantKey, which only changes when the def it
+    sits in does, and each outcome remembers the hash of the test it came from, so it's only reused
+    while that test is unchanged too. Edits to the functions a mutated def calls aren't noticed;
+    throw the database away after one of those."""
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS outcomes (mutant TEXT, test TEXT, test_hash TEXT, "
+                        "outcome TEXT, seconds REAL, PRIMARY KEY (mutant, test))")
+
+    def lookup(self, mutant_key, test_hashes):
+        "{test id: 'pass', 'failure' or 'error'} for the tests whose stored outcome is still good."
+        rows = self.db.execute("SELECT test, test_hash, outcome FROM outcomes WHERE mutant = ?", (mutant_key,))
+        return {test: outcome for test, test_hash, outcome in rows if test_hashes.get(test) == test_hash}
+
+    def record(self, mutant_key, test_hashes, result):
+        "Store the per-test outcomes of a result from runMutant and friends. Timeouts and crashes have none."
+        if result["status"] not in (KILLED, SURVIVED):
+            return
+        failures, errors = set(result["failures"]), set(result["errors"])
+        times = result.get("times", {})
+        self.db.executemany("INSERT OR REPLACE INTO outcomes VALUES (?, ?, ?, ?, ?)",
+                            [(mutant_key, test, test_hashes.get(test),
+                              "failure" if test in failures else "error" if test in errors else "pass",
+                              times.get(test)) for test in result.get("ran", ())])
+
+    def save(self):
+        self.db.commit()
+
+
+def cachedResult(name, cached):
+    "What runMutant would have returned, put back together from the store."
+    failures = [test for test, outcome in cached.items() if outcome == "failure"]
+    errors = [test for test, outcome in cached.items() if outcome == "error"]
+    return {"mutant": name, "status": KILLED if failures or errors else SURVIVED, "tests_run": 0,
+            "failures": failures, "errors": errors, "cached": True}
+
+
+def codeObjects(code):
+    "code and every code object nested in it: the functions, classes, lambdas and generators it defines."
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from codeObjects(const)
+
+
+def recordCoverage(target_path, test_path):
+    """Run the test suite once against the unmutated target with every executed bytecode
+    instruction and line of the target counted. Returns (positions, lines):
+    {(lineno, col_offset, end_lineno, end_col_offset): hits} for the source positions the
+    instructions came from, which is fine grained enough to tell which sub-expression of a line
+    actually ran, and {lineno: hits}, for where no instruction has a position that tells.
+    sys.monitoring does the counting from 3.12 on (opcode tracing no longer fires there);
+    before 3.11 code objects have no positions, so that's lines only."""
+    target_path = os.path.abspath(target_path)
+    with open(target_path, "rb") as src:
+        target_code = compile(src.read(), target_path, "exec")
+    test_code = loadTestCode(test_path)
+    counts, lines = {}, {}
+
+    def countInstruction(code, offset):
+        counts[code, offset] = counts.get((code, offset), 0) + 1
+
+    def countLine(code, lineno):
+        lines[lineno] = lines.get(lineno, 0) + 1
+
+    def run():
+        installModule(moduleName(target_path), target_code, target_path)
+        runSuite(loadTests(test_code))
+
+    saved = sys.modules.get(moduleName(target_path))
+    try:
+        if hasattr(sys, "monitoring"):
+            # only the target's own code objects, so the rest of the suite runs at full speed
+            monitoring, tool = sys.monitoring, sys.monitoring.COVERAGE_ID
+            monitoring.use_tool_id(tool, "mutant_runner")
+            monitoring.register_callback(tool, monitoring.events.INSTRUCTION, countInstruction)
+            monitoring.register_callback(tool, monitoring.events.LINE, countLine)
+            for code in codeObjects(target_code):
+                monitoring.set_local_events(tool, code, monitoring.events.INSTRUCTION | monitoring.events.LINE)
+            try:
+                run()
+            finally:
+                for code in codeObjects(target_code):
+                    monitoring.set_local_events(tool, code, 0)
+                monitoring.register_callback(tool, monitoring.events.INSTRUCTION, None)
+                monitoring.register_callback(tool, monitoring.events.LINE, None)
+                monitoring.free_tool_id(tool)
+        else:
+            def traceInstructions(frame, event, arg):
+                if event == "opcode":
+                    countInstruction(frame.f_code, frame.f_lasti)
+                elif event == "line":
+                    countLine(frame.f_code, frame.f_lineno)
+                return traceInstructions
+
+            def traceCalls(frame, event, arg):
+                if frame.f_code.co_filename != target_path:
+                    return None
+                frame.f_trace_opcodes = True
+                return traceInstructions
+            # tracing starts before the import, default arguments are evaluated by the module body
+            sys.settrace(traceCalls)
+            try:
+                run()
+            finally:
+                sys.settrace(None)
+    finally:
+        if saved is not None:
+            sys.modules[moduleName(target_path)] = saved
+
+    positions = {}
+    all_positions = {}
+    for (code, offset), hits in counts.items():
+        if not hasattr(code, "co_positions"):
+            break
+        if code not in all_positions:
+            all_positions[code] = list(code.co_positions())
+        position = all_positions[code][offset // 2]
+        if None not in position:
+            positions[position] = positions.get(position, 0) + hits
+    return positions, lines
+
+
+def recordCallMap(target_path, test_path):
+    """Run the suite once against the unmutated target with a profiler on, noting for every
+    function of the target which tests end up calling it, however indirectly.
+    Returns {function name: [test ids]}."""
+    target_path = os.path.abspath(target_path)
+    with open(target_path, "rb") as src:
+        target_code = compile(src.read(), target_path, "exec")
+    calls = {}
+    current = [None]
+
+    class TrackingResult(RecordingResult):
+        def startTest(self, test):
+            super().startTest(test)
+            current[0] = test.id()
+
+    def profile(frame, event, arg):
+        if event == "call" and current[0] and frame.f_code.co_filename == target_path:
+            calls.setdefault(frame.f_code.co_name, set()).add(current[0])
+
+    saved = sys.modules.get(moduleName(target_path))
+    installModule(moduleName(target_path), target_code, target_path)
+    suite = loadTests(loadTestCode(test_path))
+    sys.setprofile(profile)
+    try:
+        suite.run(TrackingResult())
+    finally:
+        sys.setprofile(None)
+        if saved is not None:
+            sys.modules[moduleName(target_path)] = saved
+    return {func: sorted(test_ids) for func, test_ids in calls.items()}
+
+
+# recorded inputs kept per function; past that the profiler doesn't even look at its calls
+MAX_INPUTS = 50
+# least a replayed call gets before it counts as hung, whatever the original took
+CALL_FLOOR = 0.05
+
+
+def callArguments(frame):
+    "(args, kwargs) that would make the same call as the one frame was just entered with."
+    code, values = frame.f_code, frame.f_locals
+    names = code.co_varnames
+    n = code.co_argcount + code.co_kwonlyargcount
+    args = [values[name] for name in names[:code.co_argcount]]
+    kwargs = {name: values[name] for name in names[code.co_argcount:n]}
+    if code.co_flags & inspect.CO_VARARGS:
+        args.extend(values[names[n]])
+        n += 1
+    if code.co_flags & inspect.CO_VARKEYWORDS:
+        kwargs.update(values[names[n]])
+    return args, kwargs
+
+
+def recordInputs(target_path, test_path, limit=MAX_INPUTS):
+    """Run the suite once against the unmutated target with a profiler on, keeping a copy of the
+    arguments of every call into a function of the target, up to limit different ones per
+    function. Copied on the way in, before the function gets a chance to change them.
+    Returns {function name: [(args, kwargs)]}."""
+    target_path = os.path.abspath(target_path)
+    with open(target_path, "rb") as src:
+        target_code = compile(src.read(), target_path, "exec")
+    inputs, seen = {}, {}
+
+    def profile(frame, event, arg):
+        if event != "call" or frame.f_code.co_filename != target_path:
+            return
+        func = frame.f_code.co_name
+        if len(inputs.get(func, ())) >= limit:
+            return
+        try:
+            call = copy.deepcopy(callArguments(frame))
+            key = repr(call)
+        except Exception:
+            return      # can't be copied (or printed), so can't be replayed either
+        if key not in seen.setdefault(func, set()):
+            seen[func].add(key)
+            inputs.setdefault(func, []).append(call)
+
+    saved = sys.modules.get(moduleName(target_path))
+    installModule(moduleName(target_path), target_code, target_path)
+    suite = loadTests(loadTestCode(test_path))
+    sys.setprofile(profile)
+    try:
+        suite.run(RecordingResult())
+    finally:
+        sys.setprofile(None)
+        if saved is not None:
+            sys.modules[moduleName(target_path)] = saved
+    return inputs
+
+
+def callOutcome(func, call, limit):
+    """What func does with a copy of call: ("return", value), ("raise", exception name) or ("hung",)
+    if it's still going after limit seconds. A generator is run and what it yielded is the value.
+    Returns (outcome, seconds)."""
+    args, kwargs = copy.deepcopy(call)
+    started = time.perf_counter()
+    signal.setitimer(signal.ITIMER_REAL, limit)
+    try:
+        value = func(*args, **kwargs)
+        if inspect.isgenerator(value):
+            value = list(islice(value, 10000))     # what it yields is the answer, not the generator
+        outcome = ("return", value)
+    except OverBudget:
+        outcome = ("hung",)
+    except Exception as e:
+        outcome = ("raise", type(e).__name__)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return outcome, time.perf_counter() - started
+
+
+def sameOutcome(a, b):
+    try:
+        if a == b:
+            return True
+    except Exception:
+        pass
+    # nan != nan, and some results don't do == at all
+    return repr(a) == repr(b)
+
+
+class WeakOracle:
+    """Weak mutation: instead of running the tests against a mutant, call just the functions it
+    mutated on the inputs recordInputs saw during a clean run, and compare what comes back with
+    what the original returns. A difference means the mutant is (weakly) killed; no difference
+    only means the tests have to decide. Only inputs the original answers the same way twice
+    are kept, so functions that return fresh objects or depend on the clock don't give false kills.
+    With --fork the replay runs in the mutant's child ahead of its tests, so a mutant that exits,
+    crashes or hangs there is caught like it would be in the tests. Without it the replay runs in
+    this process, and a mutant stuck inside C code hangs it, same as its tests would."""
+    def __init__(self, target_path, test_path, limit=MAX_INPUTS):
+        self.target_path = os.path.abspath(target_path)
+        with open(self.target_path, "rb") as src:
+            self.original = self.load(src.read())
+        self.expected = {}
+        previous = signal.signal(signal.SIGALRM, overBudget)
+        try:
+            for func_name, calls in recordInputs(target_path, test_path, limit).items():
+                func = self.resolve(self.original, func_name)
+                if func is None:
+                    continue
+                for call in calls:
+                    (first, seconds), (second, _) = callOutcome(func, call, 10.0), callOutcome(func, call, 10.0)
+                    if first[0] != "hung" and first[0] == second[0] and sameOutcome(first[1:], second[1:]):
+                        self.expected.setdefault(func_name, []).append((call, first, max(CALL_FLOOR, 10 * seconds)))
+        finally:
+            signal.signal(signal.SIGALRM, previous)
+
+    def load(self, mutant):
+        "The target as a module of its own, from source or a code object, without touching sys.modules."
+        if not isinstance(mutant, types.CodeType):
+            mutant = compile(mutant, self.target_path, "exec")
+        name = moduleName(self.target_path)
+        saved = sys.modules.get(name)
+        try:
+            return installModule(name, mutant, self.target_path)
+        finally:
+            if saved is not None:
+                sys.modules[name] = saved
+            else:
+                sys.modules.pop(name, None)
+
+    def resolve(self, module, func_name):
+        """The function called func_name in module: a module level one (decorators and all), or
+        the one method of that name across its classes. None if there's no telling which."""
+        func = module.__dict__.get(func_name)
+        if inspect.isfunction(func):
+            return func
+        methods = [cls.__dict__[func_name] for cls in module.__dict__.values()
+                   if inspect.isclass(cls) and cls.__module__ == module.__name__ and func_name in cls.__dict__]
+        if len(methods) != 1:
+            return None
+        # recorded calls already have self or cls in front
+        return getattr(methods[0], "__func__", methods[0])
+
+    def judge(self, module, funcs):
+        """Replay every recorded input of funcs against module's version of them. Returns what
+        gave it away if the mutant behaves differently, None if it didn't on any of them."""
+        previous = signal.signal(signal.SIGALRM, overBudget)
+        try:
+            # only what there's a recording of: no difference anywhere else is no news
+            for func_name in [func_name for func_name in funcs if func_name in self.expected]:
+                func = self.resolve(module, func_name)
+                if func is None:
+                    return "%s is gone" % func_name
+                for call, expected, limit in self.expected.get(func_name, ()):
+                    outcome, _ = callOutcome(func, call, limit)
+                    if outcome[0] != expected[0] or not sameOutcome(outcome[1:], expected[1:]):
+                        return "%s%s: %s instead of %s" % (func_name, shorten(call), shorten(outcome), shorten(expected))
+        finally:
+            signal.signal(signal.SIGALRM, previous)
+        return None
+
+
+def weakKill(oracle, mutant, funcs, name=None):
+    """The result for a mutant the oracle can already tell from the original (mutant being its
+    source, code or a module with it loaded), None if the tests will have to decide."""
+    try:
+        module = mutant if isinstance(mutant, types.ModuleType) else oracle.load(mutant)
+        difference = oracle.judge(module, funcs)
+    except Exception as e:
+        difference = "doesn't load: %s: %s" % (type(e).__name__, e)
+    if difference is None:
+        return None
+    return {"mutant": name, "status": KILLED, "tests_run": 0, "failures": [], "errors": [], "weak": True,
+            "error": difference}
+
+
+def shorten(value, length=80):
+    text = repr(value)
+    return text if len(text) <= length else text[:length - 3] + "..."
+
+
+def runMutant(mutant, target_path, test_code, name=None, order=None, fail_fast=False, only=None, budgets=None):
+    """Compile mutant (source text, an AST, or an already compiled code object) into a fresh module, install it as the target,
+    run the tests against it in this process and return what happened. The target file on
+    disk is never touched. A mutant that won't even compile or import counts as killed,
+    same as when test_full ran it. order, fail_fast, only and budgets go to runSuite."""
+    target_path = os.path.abspath(target_path)
+    target = moduleName(target_path)
+    result = {"mutant": name, "status": KILLED, "tests_run": 0, "failures": [], "errors": []}
+    saved = sys.modules.get(target)
+    try:
+        try:
+            if not isinstance(mutant, types.CodeType):
+                mutant = compile(mutant, target_path, "exec")
+            installModule(target, mutant, target_path)
+            suite = loadTests(test_code)
+        except Exception as e:
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+            return result
+        outcome = runSuite(suite, order, fail_fast, only, budgets)
+    finally:
+        if saved is not None:
+            sys.modules[target] = saved
+        else:
+            sys.modules.pop(target, None)
+    return resultOf(result, outcome)
+
+
+def resultOf(result, outcome):
+    "Fill in result from a finished RecordingResult."
+    result["tests_run"] = outcome.testsRun
+    result["ran"] = outcome.ran
+    result["times"] = outcome.times
+    result["failures"] = [test.id() for test, trace in outcome.failures]
+    result["errors"] = [test.id() for test, trace in outcome.errors]
+    result["status"] = SURVIVED if outcome.wasSuccessful() else KILLED
+    if outcome.over_budget:
+        result["status"] = TIMEOUT
+        result["error"] = "%s ran past its time budget" % outcome.over_budget
+    return result
+
+
+class SchemaRunner:
+    """Runs first-order mutants out of a mutation schema (see mutate.buildSchema). The target is
+    rewritten and compiled once with every mutant in it and the tests are loaded once; after
+    that, switching to mutant k is a single assignment to the module's __mut__."""
+    def __init__(self, target_path, test_path):
+        from mutate import buildSiteTable, buildSchema, siteKeys, SCHEMA_SWITCH
+        self.switch = SCHEMA_SWITCH
+        target_path = os.path.abspath(target_path)
+        with open(target_path, "rb") as src:
+            tree = ast.parse(src.read())
+        self.sites = buildSiteTable(tree)
+        self.keys = siteKeys(tree, self.sites)
+        schema, self.schema_ids = buildSchema(tree, self.sites)
+        self.module = installModule(moduleName(target_path), compile(schema, target_path, "exec"), target_path)
+        self.test_module = execTests(loadTestCode(test_path))
+
+    def __len__(self):
+        return len(self.schema_ids)
+
+    def funcs(self, k):
+        return [self.sites[self.schema_ids[k][0]].func]
+
+    def describe(self, k):
+        site_id, replacement = self.schema_ids[k]
+        site = self.sites[site_id]
+        return {"site": site_id, "func": site.func, "kind": site.kind, "line": site.span[0],
+                "original": site.original, "replacement": replacement,
+                "key": "%s:%s>%s" % (self.keys[site_id], site.original, replacement)}
+
+    def run(self, k, name=None, order=None, fail_fast=False, only=None, budgets=None):
+        "Same as runMutant, for schema mutant k."
+        result = {"mutant": name, "status": KILLED, "tests_run": 0, "failures": [], "errors": []}
+        setattr(self.module, self.switch, k)
+        try:
+            # a fresh suite every time, TestSuite.run drops its tests once they've run
+            outcome = runSuite(unittest.defaultTestLoader.loadTestsFromModule(self.test_module), order, fail_fast, only,
+                               budgets)
+        finally:
+            setattr(self.module, self.switch, -1)
+        return resultOf(result, outcome)
+
+
+def testIds(target_path, test_code):
+    "Ids of every test in the suite, loaded against the real target."
+    with open(target_path, "rb") as src:
+        target_code = compile(src.read(), target_path, "exec")
+    saved = sys.modules.get(moduleName(target_path))
+    installModule(moduleName(target_path), target_code, target_path)
+    test_ids = [test.id() for test in flattenSuite(loadTests(test_code))]
+    if saved is not None:
+        sys.modules[moduleName(target_path)] = saved
+    return test_ids
+
+
+def memoryInUse():
+    "Bytes of address space this process has mapped, or None where /proc isn't around."
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+# seconds a forked child gets for importing the mutant, on top of its tests' budgets
+STARTUP_BUDGET = 1.0
+
+
+class ForkServer:
+    """Runs each mutant in its own forked child. The test module and everything it imports
+    (unittest, pycodestyle, the target's own imports) are loaded once, here in the parent, so a
+    child starts warm instead of paying for a new interpreter. A child that runs past timeout
+    seconds is killed and reported as a timeout; one that dies without reporting back (a
+    segfault, the OOM killer) is a crash. With budgets (see timeBudgets) every test gets its own
+    limit inside the child, and timeout is replaced by what the tests it runs are budgeted for
+    plus STARTUP_BUDGET, so the whole campaign costs at most a known multiple of the clean suite. Allocating more than max_memory bytes raises
+    MemoryError in the child instead of taking the machine down with it.
+    execute is what the child runs, with run's arguments; runMutant by default, or e.g. a
+    SchemaRunner's run, in which case the mutants handed to run are schema ids. first, if run
+    gets one, is called in the child ahead of execute, and what it returns is the result unless
+    that's None (see weakKill)."""
+    def __init__(self, target_path, test_path, timeout=30.0, max_memory=1024 * 1024 * 1024, execute=None, budgets=None):
+        self.target_path = os.path.abspath(target_path)
+        self.test_code = loadTestCode(test_path)
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.budgets = budgets
+        self.execute = execute or (lambda mutant, name, order, fail_fast, only, budgets:
+                                   runMutant(mutant, self.target_path, self.test_code, name, order, fail_fast, only, budgets))
+        # warm up: run the test module once against the real target so all its imports are cached
+        self.test_ids = testIds(self.target_path, self.test_code)
+
+    def limitMemory(self):
+        "In the child: allow max_memory bytes on top of what the parent already had mapped."
+        in_use = memoryInUse()
+        if in_use is not None and self.max_memory:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (in_use + self.max_memory, in_use + self.max_memory))
+
+    def run(self, mutant, name=None, order=None, fail_fast=False, only=None, first=None):
+        read_fd, write_fd = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = 1
+            try:
+                self.limitMemory()
+                result = first() if first else None
+                if result is None:
+                    result = self.execute(mutant, name, order, fail_fast, only, self.budgets)
+                with os.fdopen(write_fd, "wb") as out:
+                    out.write(json.dumps(result).encode())
+                status = 0
+            finally:
+                # never fall back into the parent's code, and never run its atexit handlers
+                os._exit(status)
+        os.close(write_fd)
+
+        chunks, timed_out = [], False
+        timeout = self.timeout
+        if self.budgets:
+            timeout = STARTUP_BUDGET + sum(seconds for test_id, seconds in self.budgets.items() if only is None or test_id in only)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            ready, _, _ = select.select([read_fd], [], [], remaining)
+            if ready:
+                chunk = os.read(read_fd, 65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        if timed_out:
+            os.kill(pid, signal.SIGKILL)
+        _, wait_status = os.waitpid(pid, 0)
+        os.close(read_fd)
+
+        result = {"mutant": name, "status": CRASH, "tests_run": 0, "failures": [], "errors": []}
+        if timed_out:
+            result["status"] = TIMEOUT
+            result["error"] = "no result after %g seconds" % timeout
+        elif os.WIFSIGNALED(wait_status):
+            result["error"] = "killed by signal %d" % os.WTERMSIG(wait_status)
+        elif os.WEXITSTATUS(wait_status) != 0 or not chunks:
+            result["error"] = "exited with status %d" % os.WEXITSTATUS(wait_status)
+        else:
+            result = json.loads(b"".join(chunks))
+        return result
+
+
+def streamWorker(target_path, test_path, fork, timeout, max_memory, budgets, tasks, results, oracle=None):
+    """One process of streamMutants: run mutants off tasks until the None at the end, results go to results.
+    With a WeakOracle, the tests only run for the mutants it can't tell from the original."""
+    if fork:
+        run = ForkServer(target_path, test_path, timeout, max_memory, budgets=budgets).run
+    else:
+        test_code = loadTestCode(test_path)
+        run = lambda mutant, name, first: ((first() if first else None)
+                                           or runMutant(mutant, target_path, test_code, name, budgets=budgets))
+    for name, mutant_src, description in iter(tasks.get, None):
+        first = (lambda: weakKill(oracle, mutant_src, description["funcs"], name)) if oracle else None
+        result = run(mutant_src, name, first=first)
+        result["mutations"] = description["mutations"]
+        results.put(result)
+    results.put(None)
+
+
+def streamMutants(target_path, test_path, num_mutants, workers=1, splice=False, seed=None, tce=False,
+                  fork=False, timeout=30.0, max_memory=1024 * 1024 * 1024, budgets=None, plan="calls", weak=False):
+    """Generate mutants with mutate.generateMutants and test them while the rest are still being
+    generated, yielding each result as it comes in (so not in mutant order). Nothing is written
+    to disk, and the queue between generation and the worker processes only ever holds a couple
+    of mutants per worker, so memory doesn't grow with num_mutants."""
+    from mutate import generateMutants
+    target_path = os.path.abspath(target_path)
+    with open(target_path, "rb") as src:
+        source = src.read()
+    tree = ast.parse(source)
+    # recorded once here, the workers get it when they're forked
+    oracle = WeakOracle(target_path, test_path) if weak else None
+    # forked whatever the platform's default (spawn on macOS): the workers inherit what they're
+    # handed instead of having it pickled, and a WeakOracle holds modules, which don't pickle
+    context = multiprocessing.get_context("fork")
+    tasks, results = context.Queue(workers * 2), context.Queue()
+    processes = [context.Process(target=streamWorker, daemon=True,
+                                 args=(target_path, test_path, fork, timeout, max_memory, budgets, tasks, results, oracle))
+                 for _ in range(workers)]
+    # workers first: they're forked, and forking once the feeder thread is running would copy it mid-step
+    for process in processes:
+        process.start()
+
+    # what stopped generation, if anything did; raised here once the workers are through
+    failed = []
+
+    def feed():
+        try:
+            for number, mutant_src, description in generateMutants(tree, num_mutants, source if splice else None,
+                                                                   seed=num_mutants if seed is None else seed,
+                                                                   tce=tce, out=sys.stderr, plan=plan):
+                tasks.put(("%d.py" % number, mutant_src, description))
+        except BaseException as e:
+            failed.append(e)
+        finally:
+            # or the workers wait on tasks forever, and so do we on them
+            for _ in processes:
+                tasks.put(None)
+    threading.Thread(target=feed, daemon=True).start()
+    finished = 0
+    while finished < len(processes):
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            # a worker that died without saying so (only without --fork) would keep us here forever
+            if not any(process.is_alive() for process in processes):
+                print("Every worker died, giving up", file=sys.stderr)
+                break
+            continue
+        if result is None:
+            finished += 1
+        else:
+            yield result
+    if failed:
+        raise failed[0]
+
+
+def main(args):
+    "Run the tests against every mutant file given and print one JSON result per mutant."
+    from mutate import MutantBundle, parseOptions, planOption
+    args, options = parseOptions(args)
+    if len(args) < (3 if options.get("schema") or options.get("generate") or options.get("bundle") else 4):
+        printUsage()
+        return
+    budgets = None
+    if options.get("budget"):
+        budgets = timeBudgets(args[1], args[2], float(options["budget"]), float(options.get("budget-floor", 0.5)),
+                              int(options.get("repeats", 3)))
+        # the alarm can be swallowed, the child's timeout can't
+        options["fork"] = True
+    if options.get("generate"):
+        counts, weak_kills = {}, 0
+        for result in streamMutants(args[1], args[2], int(options["generate"]), int(options.get("workers", 1)),
+                                    bool(options.get("splice")), int(options["seed"]) if "seed" in options else None,
+                                    bool(options.get("tce")), bool(options.get("fork")),
+                                    float(options.get("timeout", 30)), int(options.get("max-memory", 1024)) * 1024 * 1024,
+                                    budgets, planOption(options), bool(options.get("weak"))):
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+            weak_kills += bool(result.get("weak"))
+            print(json.dumps(result), flush=True)
+        print("%d mutants: %s" % (sum(counts.values()), ", ".join("%d %s" % (n, status) for status, n in sorted(counts.items()))),
+              file=sys.stderr)
+        if options.get("weak"):
+            print("%d of them killed by the weak oracle alone" % weak_kills, file=sys.stderr)
+        return
+    target_path, test_path, mutant_paths = os.path.abspath(args[1]), args[2], args[3:]
+    # what mutate.py says each mutant touched
+    manifest = {}
+    if os.path.exists(options.get("manifest", "mutants.json")):
+        with open(options.get("manifest", "mutants.json")) as src:
+            manifest = json.load(src)
+    # (name, what load turns into what run takes, functions it touches or None if we don't know,
+    # result store key or None)
+    if options.get("schema"):
+        schema = SchemaRunner(target_path, test_path)
+        execute = schema.run
+        load = lambda k: k
+        mutants = [("schema:%d" % k, k, schema.funcs(k), mutantKey([schema.describe(k)])) for k in range(len(schema))]
+    elif options.get("bundle"):
+        execute = None
+        bundle = MutantBundle(options["bundle"])
+        with open(target_path, "rb") as src:
+            source = src.read()
+        if not bundle.matches(source):
+            print("%s was made from a different %s, regenerate it" % (options["bundle"], args[1]), file=sys.stderr)
+            return
+        load = lambda k: bundle.mutant(k, source)
+        mutants = []
+        for k in range(len(bundle)):
+            entry = manifest.get("%d.py" % k)
+            mutants.append(("%s:%d" % (options["bundle"], k), k, entry["funcs"] if entry else None,
+                            mutantKey(entry["mutations"]) if entry else None))
+    else:
+        execute = None
+
+        def load(mutant_path):
+            with open(mutant_path, "rb") as src:
+                return src.read()
+        mutants = []
+        for mutant_path in mutant_paths:
+            entry = manifest.get(os.path.basename(mutant_path))
+            mutants.append((mutant_path, mutant_path, entry["funcs"] if entry else None,
+                            mutantKey(entry["mutations"]) if entry else None))
+    if options.get("fork"):
+        server = ForkServer(target_path, test_path, timeout=float(options.get("timeout", 30)),
+                            max_memory=int(options.get("max-memory", 1024)) * 1024 * 1024, execute=execute,
+                            budgets=budgets)
+        run, test_ids = server.run, server.test_ids
+    else:
+        test_code = loadTestCode(test_path)
+        test_ids = testIds(target_path, test_code)
+        execute = execute or (lambda mutant, name, order, fail_fast, only, budgets:
+                              runMutant(mutant, target_path, test_code, name, order, fail_fast, only, budgets))
+        run = lambda mutant, name, order, fail_fast, only, first=None: ((first() if first else None)
+                                                                        or execute(mutant, name, order, fail_fast, only, budgets))
+    fail_fast = bool(options.get("fail-fast"))
+    stats = KillStats(options.get("stats", "kill_stats.json")) if fail_fast else None
+    call_map = recordCallMap(target_path, test_path) if options.get("select") else None
+    store = ResultStore(options["store"]) if options.get("store") else None
+    test_hashes = testHashes(test_path) if store else None
+    oracle = WeakOracle(target_path, test_path) if options.get("weak") else None
+    counts, weak_kills = {}, 0
+    for name, mutant, funcs, key in mutants:
+        order = stats.order(funcs or [], test_ids) if stats else None
+        only = None
+        if call_map is not None and funcs is not None:
+            only = set().union(*(call_map.get(func, ()) for func in funcs))
+        if store and key:
+            cached = store.lookup(key, test_hashes)
+            wanted = set(test_ids) if only is None else only
+            cached = {test: outcome for test, outcome in cached.items() if test in wanted}
+            if any(outcome != "pass" for outcome in cached.values()) or wanted <= set(cached):
+                result = cachedResult(name, cached)
+                if options.get("schema"):
+                    result["mutation"] = schema.describe(mutant)
+                counts[result["status"]] = counts.get(result["status"], 0) + 1
+                print(json.dumps(result))
+                continue
+            # the ones it already survived can't kill it now either
+            only = wanted - set(cached)
+        mutant_code = load(mutant)
+        first = None
+        if oracle and funcs:
+            # with --fork this runs in the child, so a mutant that exits or hangs in the replay
+            # only takes that down
+            def first(mutant=mutant, mutant_code=mutant_code, funcs=funcs, name=name):
+                if not options.get("schema"):
+                    return weakKill(oracle, mutant_code, funcs, name)
+                setattr(schema.module, schema.switch, mutant)
+                try:
+                    return weakKill(oracle, schema.module, funcs, name)
+                finally:
+                    setattr(schema.module, schema.switch, -1)
+        result = run(mutant_code, name, order, fail_fast, only, first)
+        # not stored or counted in the kill stats, no test had any say in it
+        if result.get("weak"):
+            if options.get("schema"):
+                result["mutation"] = schema.describe(mutant)
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+            weak_kills += 1
+            print(json.dumps(result))
+            continue
+        if stats:
+            stats.record(funcs or [], result)
+        if store and key:
+            store.record(key, test_hashes, result)
+        if options.get("schema"):
+            result["mutation"] = schema.describe(mutant)
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        print(json.dumps(result))
+    if stats:
+        stats.save()
+    if store:
+        store.save()
+    print("%d mutants: %s" % (len(mutants), ", ".join("%d %s" % (n, status) for status, n in sorted(counts.items()))),
+          file=sys.stderr)
+    if oracle:
+        print("%d of them killed by the weak oracle alone" % weak_kills, file=sys.stderr)
+
+
+def printUsage():
+    print("USAGE: mutant_runner.py <target file> <test file> <mutant files...> [--fork] [--timeout=S] [--max-memory=MB]")
+    print("                        [--fail-fast] [--stats=FILE] [--select] [--manifest=FILE] [--store=DB]")
+    print("       mutant_runner.py <target file> <test file> --schema [options]")
+    print("       mutant_runner.py <target file> <test file> --bundle=FILE [options]")
+    print("       mutant_runner.py <target file> <test file> --generate=N [--workers=N] [--splice] [--seed=S] [--tce]")
+    print("                        [--exhaustive | --stratified]")
+    print("                        [--fork] [--timeout=S] [--max-memory=MB]")
+    print("  any of them also takes [--budget=F] [--budget-floor=S] [--repeats=N] [--weak]")
+    print("  e.g. mutant_runner.py fuzzywuzzy.py publictest-full.py [0-9]*.py")
+    print("  --schema      run every first-order mutant of the target out of one mutation schema, no mutant files needed")
+    print("  --bundle      run every mutant in the bundle mutate.py --bundle=FILE wrote")
+    print("  --fork        run every mutant in a forked child, so hangs and crashes can't take the run down")
+    print("  --timeout     with --fork, seconds a mutant gets before it counts as a timeout (default 30)")
+    print("  --max-memory  with --fork, megabytes a mutant may allocate on top of the parent (default 1024)")
+    print("  --budget      time the clean suite first and give each test F times its usual time against a mutant;")
+    print("                overrunning counts as a timeout. Implies --fork; the child's limit becomes the sum of those")
+    print("  --budget-floor  seconds no test budget goes under (default 0.5)")
+    print("  --repeats     clean suite runs the budgets are the median of (default 3)")
+    print("  --fail-fast   stop a mutant at its first failing test, trying the tests likeliest to kill it first")
+    print("  --stats       where --fail-fast keeps its kill counts between runs (default kill_stats.json)")
+    print("  --select      only run the tests that call (directly or not) a function the mutant touched")
+    print("  --manifest    the mutants.json mutate.py wrote, for which function each mutant touched (default mutants.json)")
+    print("  --generate    make N mutants the way mutate.py would and test them as they come, no files written")
+    print("  --workers     with --generate, how many processes run mutants side by side (default 1)")
+    print("  --store       SQLite file of earlier results; mutants whose def and tests haven't changed since aren't rerun")
+    print("  --weak        record the arguments every function of the target gets in a clean run, and replay them against")
+    print("                a mutant's mutated functions first; one that answers differently counts as killed (\"weak\": true)")
+    print("                without running the tests, the rest go through the suite as usual. The replay runs where")
+    print("                the tests would: in the mutant's child with --fork, in this process without")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
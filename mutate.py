@@ -2,11 +2,55 @@ import ast
 from pprint import pprint
 import sys
 import random
-from copy import deepcopy
+import multiprocessing
+import types
+import json
+import hashlib
+import bisect
+import math
+import mmap
+import struct
+import os
+import pickle
+from itertools import islice
+from copy import deepcopy, copy
+from collections import namedtuple
 import astor
+from astor.file_util import CodeToAst
+
+NodeMetrics = namedtuple("NodeMetrics", ["size", "height", "depth", "preorder"])
+# node types the parser only makes one of each and shares
+SHARED_NODES = (ast.expr_context, ast.operator, ast.unaryop, ast.cmpop, ast.boolop)
+
+def annotateTree(root):
+    """Subtree size, height, depth and pre-order index of every node under root, each a dict keyed
+    by node. One walk with an explicit stack and one sweep back up, so it's linear and a deep tree
+    can't hit the recursion limit. The walk goes by position, but the parser hands out a single
+    Load()/Store()/Add() etc. and reuses it all over the tree, so those have no one depth or
+    pre-order index and are left out of the dicts, unless one is root (they still count towards
+    their parents' size and height)."""
+    nodes, parents, depths = [], [], []
+    stack = [(root, -1, 0)]
+    while stack:
+        node, parent, depth = stack.pop()
+        index = len(nodes)
+        nodes.append(node)
+        parents.append(parent)
+        depths.append(depth)
+        # reversed, so the children come back off the stack in source order
+        stack.extend((child, index, depth + 1) for child in reversed(list(ast.iter_child_nodes(node))))
+    sizes, heights = [1] * len(nodes), [0] * len(nodes)
+    # children always come after their parent, so going backwards every child is done first
+    for index in range(len(nodes) - 1, 0, -1):
+        parent = parents[index]
+        sizes[parent] += sizes[index]
+        heights[parent] = max(heights[parent], heights[index] + 1)
+    keep = [index for index, node in enumerate(nodes) if index == 0 or not isinstance(node, SHARED_NODES)]
+    return NodeMetrics({nodes[i]: sizes[i] for i in keep}, {nodes[i]: heights[i] for i in keep},
+                       {nodes[i]: depths[i] for i in keep}, {nodes[i]: i for i in keep})
 
 def tree_size(node):
-    return 1 + sum(tree_size(child) for child in ast.iter_child_nodes(node))
+    return annotateTree(node).size[node]
 
 class FunctionCounter(ast.NodeVisitor):
     def __init__(self):
@@ -14,6 +58,11 @@ class FunctionCounter(ast.NodeVisitor):
         self.function_tree_size = {}
         self.function_defs = set()
         self.num_defs = 0
+        self.metrics = None
+
+    def visit_Module(self, node):
+        self.metrics = annotateTree(node)
+        self.generic_visit(node)
     
     def visit_Call(self, node):
         if isinstance(node.func, ast.Name):
@@ -21,7 +70,7 @@ class FunctionCounter(ast.NodeVisitor):
                 self.function_call_count[node.func.id] += 1
             else:
                 self.function_call_count[node.func.id] = 1
-                self.function_tree_size[node.func.id] = tree_size(node)
+                self.function_tree_size[node.func.id] = self.metrics.size[node] if self.metrics else tree_size(node)
         # special key that is number of definitions, 
         # has a space so it never gets overwritten by a function name
         
@@ -41,227 +90,647 @@ class FunctionCounter(ast.NodeVisitor):
         return {"call_count": self.function_call_count, "func_tree_size": self.function_tree_size}
 
 
-class NodeFinder(ast.NodeTransformer):
-    def __init__(self, func_name, dont_mutate_until, max_mutations, mutants_so_far):
-        self.dont_mutate_until = dont_mutate_until
-        self.func_to_mutate = func_name
-        self.max_mutations = max_mutations
-        self.mutants_so_far = mutants_so_far
+# Everything each operator can turn into. The first one is what the usual mutant plan uses;
+# the rest come out with --exhaustive and in the schema.
+REPLACEMENTS = {
+    ast.GtE: (ast.Lt, ast.Gt, ast.LtE, ast.Eq, ast.NotEq),
+    ast.Gt: (ast.LtE, ast.GtE, ast.Lt, ast.Eq, ast.NotEq),
+    ast.LtE: (ast.Gt, ast.Lt, ast.GtE, ast.Eq, ast.NotEq),
+    ast.Lt: (ast.GtE, ast.LtE, ast.Gt, ast.Eq, ast.NotEq),
+    ast.Eq: (ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE),
+    ast.NotEq: (ast.Eq, ast.Lt, ast.LtE, ast.Gt, ast.GtE),
+    ast.Add: (ast.Sub, ast.Mult, ast.FloorDiv),
+    ast.Sub: (ast.Add, ast.Mult, ast.FloorDiv),
+    ast.Mult: (ast.FloorDiv, ast.Add, ast.Sub),
+    ast.FloorDiv: (ast.Mult, ast.Add, ast.Sub),
+    ast.And: (ast.Or,),
+    ast.Or: (ast.And,),
+}
 
-    def visit_FunctionDef(self, node):
-        if node.name == self.func_to_mutate:
-            mutator = MutationChamber(mutants_so_far=self.mutants_so_far, dont_mutate_until=self.dont_mutate_until, max_mutations=self.max_mutations)
-            node = mutator.visit(node)
-        print(node)
-        #breakpoint()
-        return node
+def replacementNames(op):
+    return [replacement.__name__ for replacement in REPLACEMENTS[op]]
 
-class MutationChamber(ast.NodeTransformer):
-    def __init__(self, mutants_so_far, dont_mutate_until: int, max_mutations: int = 1, ):
-        self.num_mutations = 0
-        self.dont_mutate_until = dont_mutate_until
-        self.nodes_so_far = 0
-        self.max_mutations = max_mutations
-        self.mutants_so_far = mutants_so_far
-        # SECOND IDEA: we could just mutate the first node for the first mutant, 
-        # the second node for the second mutant, etc.
+# One row of the site table. path is a tuple of (field, index) steps from the module root
+# (index is None for non-list fields), span is (lineno, col_offset, end_lineno, end_col_offset),
+# func is the name of the innermost enclosing def, original is what the node is now and
+# replacements are what it can become. gaps are the spans the operator token sits in (between
+# the operands), or just span for sites that get replaced wholesale. operands are the spans of
+# operands that are arithmetic themselves, which need brackets if the operator's precedence changes.
+MutationSite = namedtuple("MutationSite", ["path", "kind", "span", "func", "original", "replacements", "gaps", "operands"],
+                          defaults=((),))
 
-        # THIRD IDEA: We could organize all the nodes in the tree by line number, 
-        # and then mutate the nodes in order from the earliest line to the latest line.
+# How each operator/replacement is spelled in source, for splicing.
+SYMBOLS = {
+    "Lt": "<", "LtE": "<=", "Gt": ">", "GtE": ">=", "Eq": "==", "NotEq": "!=",
+    "Add": "+", "Sub": "-", "Mult": "*", "FloorDiv": "//",
+    "And": "and", "Or": "or", "True": "True", "False": "False", "Pass": "pass",
+}
 
+# How tightly each arithmetic operator binds. Splicing one from another level in needs brackets.
+PRECEDENCE = {"Add": 1, "Sub": 1, "Mult": 2, "FloorDiv": 2}
 
-        # LAST IDEA AND THE FIRST ONE WE'LL TRY: 
-        # Randomly decide whether to mutate each node as we look at it using random.choice([True, False])random.choice([True, False]) and num_mutations < 2, setting random.seed(num_mutants) at the start of the program.
 
-    def shouldMutate(self, node):
-        return self.nodes_so_far >= self.dont_mutate_until and self.num_mutations < self.max_mutations
+def span(node):
+    return (node.lineno, node.col_offset, node.end_lineno, node.end_col_offset)
+
+
+def gap(before, after):
+    "The span between two operands, which is where their operator token lives."
+    return (before.end_lineno, before.end_col_offset, after.lineno, after.col_offset)
+
+
+class SiteIndexer(ast.NodeVisitor):
+    """Walks the whole module exactly once and writes down every node a mutant could change,
+    so picking a mutant is a lookup instead of another trip through the tree."""
+    def __init__(self):
+        self.sites = []
+        self.path = []
+        self.funcs = []
+
+    def generic_visit(self, node):
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                for i, item in enumerate(value):
+                    if isinstance(item, ast.AST):
+                        self.path.append((field, i))
+                        self.visit(item)
+                        self.path.pop()
+            elif isinstance(value, ast.AST):
+                self.path.append((field, None))
+                self.visit(value)
+                self.path.pop()
+
+    def addSite(self, node, original, replacements, gaps=None, operands=(), kind=None):
+        # only code inside a def gets mutated, module level code is off limits
+        if self.funcs and replacements:
+            gaps = tuple(gaps) if gaps else (span(node),)
+            self.sites.append(MutationSite(tuple(self.path), kind or type(node).__name__, span(node), self.funcs[-1],
+                                           original, tuple(replacements), gaps, tuple(operands)))
+
+    def visit_FunctionDef(self, node):
+        self.funcs.append(node.name)
+        self.generic_visit(node)
+        self.funcs.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
 
     def visit_Compare(self, node):
-        if(self.shouldMutate(node)):
-            self.num_mutations += 1
-            if isinstance(node.ops[0], ast.GtE):
-                node.ops[0] = ast.Lt()
-            elif isinstance(node.ops[0], ast.Gt):
-                node.ops[0] = ast.LtE()
-            elif isinstance(node.ops[0], ast.LtE):
-                node.ops[0] = ast.Gt()
-            elif isinstance(node.ops[0], ast.Lt):
-                node.ops[0] = ast.GtE()
-            elif isinstance(node.ops[0], ast.Eq):
-                node.ops[0] = ast.NotEq()
-            elif isinstance(node.ops[0], ast.NotEq):
-                node.ops[0] = ast.Eq()
-        self.nodes_so_far += 1
-#        print(f"Visiting node: {ast.dump(node)}")
-#        print("\n")
-#        print(f"Returning: {node}")
-#        print("\n")
-        return node
+        op = type(node.ops[0])
+        if op in REPLACEMENTS:
+            self.addSite(node, op.__name__, replacementNames(op), [gap(node.left, node.comparators[0])])
+        self.generic_visit(node)
 
+    def visit_BinOp(self, node):
+        op = type(node.op)
+        if op in REPLACEMENTS:
+            operands = [span(operand) for operand in (node.left, node.right) if isinstance(operand, ast.BinOp)]
+            self.addSite(node, op.__name__, replacementNames(op), [gap(node.left, node.right)], operands)
+        self.generic_visit(node)
 
-    def visit_If(self, node):
-        if(self.nodes_so_far >= self.dont_mutate_until  and self.num_mutations < self.max_mutations):
-            self.num_mutations += 1
-            if isinstance(node.test, ast.Compare):
-                if isinstance(node.test.ops[0], ast.GtE):
-                    node.test.ops[0] = ast.Lt()
-                elif isinstance(node.test.ops[0], ast.Gt):
-                    node.test.ops[0] = ast.LtE()
-                elif isinstance(node.test.ops[0], ast.LtE):
-                    node.test.ops[0] = ast.Gt()
-                elif isinstance(node.test.ops[0], ast.Lt):
-                    node.test.ops[0] = ast.GtE()
-                elif isinstance(node.test.ops[0], ast.Eq):
-                    node.test.ops[0] = ast.NotEq()
-                elif isinstance(node.test.ops[0], ast.NotEq):
-                    node.test.ops[0] = ast.Eq()
-        self.nodes_so_far += 1
-#        print(f"Visiting node: {ast.dump(node)}")
-#        print("\n")
-#        print(f"Returning: {node}")
-#        print("\n")
-        return node
-    
+    def visit_BoolOp(self, node):
+        op = type(node.op)
+        if op in REPLACEMENTS:
+            # a and b and c is one BoolOp, so every "and" in it flips together
+            gaps = [gap(a, b) for a, b in zip(node.values, node.values[1:])]
+            self.addSite(node, op.__name__, replacementNames(op), gaps)
+        self.generic_visit(node)
 
     def visit_Constant(self, node):
-        if(self.shouldMutate(node)):
-            self.num_mutations += 1
-            if node.value is True:
-                node.value = False
-            elif node.value is False:
-                node.value = True
-        self.nodes_so_far += 1
-#        print(f"Visiting node: {ast.dump(node)}")
-#        print("\n")
-#        print(f"Returning: {node}")
-#        print("\n")
-        return node
+        if node.value is True or node.value is False:
+            self.addSite(node, str(node.value), [str(not node.value)])
 
+    def visit_Assign(self, node):
+        self.addSite(node, type(node).__name__, ["Pass"])
+        self.generic_visit(node)
 
-    def visit_BinOp(self, node):
-        if(self.shouldMutate(node)):
-            self.num_mutations += 1
-            if isinstance(node.op, ast.Add):
-                node.op = ast.Sub()
-            elif isinstance(node.op, ast.Sub):
-                node.op = ast.Add()
-            elif isinstance(node.op, ast.Mult):
-                node.op = ast.FloorDiv()
-            elif isinstance(node.op, ast.FloorDiv):
-                node.op = ast.Mult()
-        self.nodes_so_far += 1
-#        print(f"Visiting node: {ast.dump(node)}")
-#        print("\n")
-#        print(f"Returning: {node}")
-#        print("\n")
-        return node
+    def visit_Expr(self, node):
+        # a call can only become pass where it's a statement of its own, and then it's the whole
+        # statement that goes. Anywhere else (return f(x), len(x) > 0) pass doesn't even compile
+        if isinstance(node.value, ast.Call):
+            self.addSite(node, "Call", ["Pass"], kind="Call")
+        self.generic_visit(node)
 
 
-    def visit_BoolOp(self, node):
-        if(self.shouldMutate(node)):
-            self.num_mutations += 1
-            if isinstance(node.op, ast.And):
-                node.op = ast.Or()
-            elif isinstance(node.op, ast.Or):
-                node.op = ast.And()
-        self.nodes_so_far += 1
-#        print(f"Visiting node: {ast.dump(node)}")
-#        print("\n")
-#        print(f"Returning: {node}")
-#        print("\n")
-        return node
+def buildSiteTable(tree):
+    "Enumerate every mutable site of the module in one pass."
+    indexer = SiteIndexer()
+    indexer.visit(tree)
+    return indexer.sites
 
 
-    """  def visit_Subscript(self, node):
-        if(self.shouldMutate(node)):
-            self.num_mutations += 1
-            if isinstance(node.slice, ast.Index):
-                if isinstance(node.slice.value, ast.Constant) and isinstance(node.slice.value.value, int):
-            # Add or subtract 1 from the subscript
-                    if random.choice([True, False]):
-                        node.slice.value.n += 1
-                    else:
-                        node.slice.value.n -= 1
-        self.nodes_so_far += 1
-#        print(f"Visiting node: {ast.dump(node)}")
-#        print("\n")
-#        print(f"Returning: {node}")
-#        print("\n")
-        return node"""
+def siteKeys(tree, sites):
+    """A name for every site that still means the same thing after edits elsewhere in the file:
+    the classes and defs it sits in (A.size), a hash of the innermost def (of its ast, so moving or
+    reformatting the def changes nothing) and its path inside that def. Without the names, the
+    same method in two classes would share its keys. mutant_runner's result store caches
+    outcomes on these."""
+    hashes = {}
+    keys = []
+    for site in sites:
+        node, func, start, scope = tree, tree, 0, []
+        for depth, (field, i) in enumerate(site.path):
+            node = getattr(node, field) if i is None else getattr(node, field)[i]
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                scope.append(node.name)
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                func, start = node, depth + 1
+        if id(func) not in hashes:
+            hashes[id(func)] = hashlib.sha1(ast.dump(func).encode()).hexdigest()[:16]
+        path = "/".join(field if i is None else "%s.%d" % (field, i) for field, i in site.path[start:])
+        keys.append("%s:%s:%s" % (".".join(scope) or "<module>", hashes[id(func)], path))
+    return keys
 
 
-    def visit_Assign(self, node):
-        if(self.shouldMutate(node)):
-            self.nodes_so_far += 1
-            self.num_mutations += 1
-            return ast.Pass() 
-        else:
-            self.nodes_so_far += 1
-#        print(f"Visiting node: {ast.dump(node)}")
-#        print("\n")
-#        print(f"Returning: {node}")
-#        print("\n")
-        return node
+def resolvePath(tree, path):
+    node = tree
+    for field, i in path:
+        node = getattr(node, field)
+        if i is not None:
+            node = node[i]
+    return node
 
 
-    def visit_Call(self, node):
-        if(self.shouldMutate(node)):
-            self.nodes_so_far += 1
-            self.num_mutations
-            return ast.Pass()
-        else:
-            self.nodes_so_far += 1
-#        print(f"Visiting node: {ast.dump(node)}")
-#        print("\n")
-#        print(f"Returning: {node}")
-#        print("\n")
-        return node
+def mutatedNode(node, site, replacement):
+    "The node a site turns into. node itself is left alone, its children are shared."
+    if replacement == "Pass":
+        return ast.copy_location(ast.Pass(), node)
+    new_node = copy(node)
+    if site.kind == "Constant":
+        new_node.value = replacement == "True"
+    elif site.kind == "Compare":
+        new_node.ops = [getattr(ast, replacement)()] + node.ops[1:]
+    else:
+        new_node.op = getattr(ast, replacement)()
+    return new_node
 
-        
-"""    def visit_FunctionDef(self, node):
-        print(node.name)
-        self.nodes_so_far += 1
-#        print(f"Visiting node: {ast.dump(node)}")
-#        print("\n")
-#        print(f"Returning: {node}")
-#        print("\n")
-        return node"""
+
+def replaceAt(tree, path, new_node):
+    parent = resolvePath(tree, path[:-1])
+    field, i = path[-1]
+    if i is None:
+        setattr(parent, field, new_node)
+    else:
+        getattr(parent, field)[i] = new_node
+
+
+def mutateSite(tree, site, replacement):
+    "Apply one row of the site table to tree, in place."
+    replaceAt(tree, site.path, mutatedNode(resolvePath(tree, site.path), site, replacement))
+
+
+class Mutation:
+    """One change to one site. A mutant is just a tuple of these, so we never have to hang on to
+    mutant trees to know what we already made."""
+    __slots__ = ("site_id", "original", "replacement")
+
+    def __init__(self, site_id, original, replacement):
+        self.site_id = site_id
+        self.original = original
+        self.replacement = replacement
+
+    def __repr__(self):
+        return "Mutation(%d, %s -> %s)" % (self.site_id, self.original, self.replacement)
+
+
+def fingerprint(mutations):
+    "Canonical key of a set of mutations, the same whatever order they were picked in."
+    return tuple(sorted((m.site_id, m.replacement) for m in mutations))
+
+
+class MutantPool:
+    """Every mutant made so far, as Mutation tuples, with an O(1) duplicate check.
+    Replaces comparing each new tree against a list of all the old ones."""
+    def __init__(self):
+        self.seen = set()
+        self.mutants = []
+
+    def add(self, mutations):
+        "Remember mutations and return True, or return False if we already have this mutant."
+        key = fingerprint(mutations)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        self.mutants.append(tuple(mutations))
+        return True
+
+    def __contains__(self, mutations):
+        return fingerprint(mutations) in self.seen
+
+    def __len__(self):
+        return len(self.mutants)
+
+
+def pickMutations(sites, site_ids):
+    """Mutations for the chosen sites. Sites inside another chosen site that turns into Pass are
+    dropped, they would vanish anyway and would just make one mutant look like two."""
+    gone = [sites[site_id].path for site_id in site_ids if sites[site_id].replacements[0] == "Pass"]
+    return [Mutation(site_id, sites[site_id].original, sites[site_id].replacements[0]) for site_id in site_ids
+            if not any(len(path) < len(sites[site_id].path) and sites[site_id].path[:len(path)] == path for path in gone)]
+
+
+class MutantEnumerator:
+    """Every first-order mutant of a site table, each exactly once: site by site, and each site's
+    replacements in REPLACEMENTS order. len() is known up front and mutant k is a bisect away,
+    so picking any number of them takes no trial and error."""
+    def __init__(self, sites):
+        self.sites = sites
+        self.starts = []
+        self.total = 0
+        for site in sites:
+            self.starts.append(self.total)
+            self.total += len(site.replacements)
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += self.total
+        if not 0 <= k < self.total:
+            raise IndexError("mutant %d out of %d" % (k, self.total))
+        site_id = bisect.bisect_right(self.starts, k) - 1
+        site = self.sites[site_id]
+        return [Mutation(site_id, site.original, site.replacements[k - self.starts[site_id]])]
+
+    def __iter__(self):
+        for site_id, site in enumerate(self.sites):
+            for replacement in site.replacements:
+                yield [Mutation(site_id, site.original, replacement)]
+
+
+def applyMutations(tree, sites, mutations):
+    "Apply several mutations at once. Deepest first, so a site inside an Assign that became Pass still resolves."
+    for m in sorted(mutations, key=lambda m: len(sites[m.site_id].path), reverse=True):
+        mutateSite(tree, sites[m.site_id], m.replacement)
+    return tree
+
+
+def materializeMutant(tree, sites, mutations):
+    """Build a mutant without deepcopy(tree): only the nodes (and the lists holding them) on the
+    way from the module root down to each mutated site get cloned, every other subtree is shared
+    with the pristine tree. Never mutate the result in place outside of mutateSite."""
+    return applyMutations(cloneSpine(tree, [sites[m.site_id].path for m in mutations]), sites, mutations)
+
+
+def cloneSpine(tree, paths):
+    "Copy of tree where the nodes along each of paths are fresh and everything else is shared."
+    spine = {(): copy(tree)}
+    copied_lists = set()
+
+    def clone(path):
+        if path not in spine:
+            parent = clone(path[:-1])
+            field, i = path[-1]
+            if i is None:
+                node = copy(getattr(parent, field))
+                setattr(parent, field, node)
+            else:
+                if (path[:-1], field) not in copied_lists:
+                    setattr(parent, field, list(getattr(parent, field)))
+                    copied_lists.add((path[:-1], field))
+                node = copy(getattr(parent, field)[i])
+                getattr(parent, field)[i] = node
+            spine[path] = node
+        return spine[path]
+
+    for path in paths:
+        clone(path)
+    return spine[()]
+
+
+def copyForFunction(node, func_name):
+    """For mutate_DAMNIT.py and mutate___.py, whose NodeFinder only ever changes the defs called
+    func_name: deep copy those and the statements above them, share everything else with tree."""
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return deepcopy(node) if node.name == func_name else node
+    new_node = None
+    for field in ("body", "orelse", "finalbody", "handlers", "cases"):
+        stmts = getattr(node, field, None)
+        if isinstance(stmts, list):
+            copied = [copyForFunction(child, func_name) for child in stmts]
+            if any(new is not old for new, old in zip(copied, stmts)):
+                if new_node is None:
+                    new_node = copy(node)
+                setattr(new_node, field, copied)
+    return node if new_node is None else new_node
+
+
+def siteHits(sites, coverage):
+    """How often each site ran in the baseline test run, from mutant_runner.recordCoverage.
+    That is the hit count of the busiest instruction inside the site's span, or failing that
+    of the instruction the site sits in (return True compiles to one instruction for the
+    whole statement; only one on the same lines, the one that makes a function spans all of
+    it and runs whether or not the function ever does), or failing that of the busiest line
+    the site is on (a folded constant, like a def's default arguments, may have no instruction
+    of its own), so a zero really does mean the tests never got there."""
+    positions, lines = coverage
+    by_line = {}
+    for position, hits in positions.items():
+        by_line.setdefault(position[0], []).append((position, hits))
+    enclosing = sorted(positions.items())
+    result = []
+    for site in sites:
+        lineno, col, end_lineno, end_col = site.span
+        inside = 0
+        for line in range(lineno, end_lineno + 1):
+            for (l, c, el, ec), hits in by_line.get(line, ()):
+                if (l, c) >= (lineno, col) and (el, ec) <= (end_lineno, end_col):
+                    inside = max(inside, hits)
+        if not inside:
+            inside = max((hits for (l, c, el, ec), hits in enclosing
+                          if l == lineno and el == end_lineno and c <= col and ec >= end_col), default=0)
+        if not inside:
+            inside = max((lines.get(line, 0) for line in range(lineno, end_lineno + 1)), default=0)
+        result.append(inside)
+    return result
+
+
+# the module global a schema reads to decide which mutant is live; -1 is none of them.
+# Dunder on both ends so it doesn't get name-mangled inside classes.
+SCHEMA_SWITCH = "__mut__"
+
+
+def schemaGuard(k, node):
+    "__mut__ == k, placed where node is."
+    test = ast.Compare(left=ast.Name(id=SCHEMA_SWITCH, ctx=ast.Load()), ops=[ast.Eq()], comparators=[ast.Constant(value=k)])
+    return ast.copy_location(test, node)
+
+
+def buildSchema(tree, sites):
+    """Mutation schema: one module that holds every first-order mutant at once. Each mutable
+    expression becomes (mutant) if __mut__ == k else (original), and each statement that can
+    turn into pass becomes if __mut__ != k: <statement>. Set the module's __mut__ to k to
+    switch mutant k on, no re-parsing, re-compiling or re-importing needed.
+    Returns (schema tree, [(site id, replacement)] indexed by k). Default arguments, decorators and
+    annotations get no k: those are evaluated once when the def runs (if at all), long before
+    anyone sets __mut__."""
+    schema = deepcopy(tree)
+    schema_ids = []
+    # deepest first: by the time a site gets wrapped everything inside it already is, and
+    # wrapping it doesn't move anything that still has to be found by path
+    for site_id in sorted(range(len(sites)), key=lambda s: len(sites[s].path), reverse=True):
+        site = sites[site_id]
+        if any(field in ("defaults", "kw_defaults", "decorator_list", "annotation", "returns") for field, i in site.path):
+            continue
+        original = node = resolvePath(schema, site.path)
+        for replacement in site.replacements:
+            if replacement != "Pass":
+                k = len(schema_ids)
+                node = ast.copy_location(ast.IfExp(test=schemaGuard(k, original), body=mutatedNode(original, site, replacement), orelse=node), original)
+                replaceAt(schema, site.path, node)
+            else:
+                stmt = resolvePath(schema, site.path)
+                k = len(schema_ids)
+                test = schemaGuard(k, stmt)
+                test.ops = [ast.NotEq()]
+                replaceAt(schema, site.path, ast.copy_location(ast.If(test=test, body=[stmt], orelse=[]), stmt))
+            schema_ids.append((site_id, replacement))
+    # __mut__ = -1 right after the docstring and __future__ imports
+    at = 0
+    while at < len(schema.body) and (isinstance(schema.body[at], ast.ImportFrom) and schema.body[at].module == "__future__"
+                                     or at == 0 and isinstance(schema.body[0], ast.Expr) and isinstance(schema.body[0].value, ast.Constant)):
+        at += 1
+    schema.body.insert(at, ast.Assign(targets=[ast.Name(id=SCHEMA_SWITCH, ctx=ast.Store())], value=ast.Constant(value=-1)))
+    return ast.fix_missing_locations(schema), schema_ids
+
+
+def lineStarts(source):
+    "Byte offset of the start of every line of source (bytes), 1-indexed like ast line numbers."
+    starts = [0, 0]
+    i = source.find(b"\n")
+    while i != -1:
+        starts.append(i + 1)
+        i = source.find(b"\n", i + 1)
+    return starts
+
+
+def findToken(text, symbol):
+    "Offset of symbol in the text between two operands. Only brackets, whitespace and comments can get in the way."
+    i = 0
+    while i < len(text):
+        if text[i:i + 1] == b"#":
+            i = text.find(b"\n", i)
+            if i == -1:
+                break
+        elif text.startswith(symbol, i):
+            return i
+        i += 1
+    raise ValueError("no %r between the operands" % symbol)
+
+
+def buildSpliceTable(source, sites):
+    """Turn every site's gaps into byte ranges of source (bytes) that hold the text to replace,
+    plus the byte ranges to put brackets around if the replacement binds differently (the site
+    itself and its arithmetic operands; the ones that already have brackets just get two).
+    ast col_offsets count utf-8 bytes, which is why this works on bytes and not str."""
+    starts = lineStarts(source)
+    table = []
+    for site in sites:
+        brackets = ()
+        if site.kind == "BinOp":
+            brackets = tuple((starts[lineno] + col, starts[end_lineno] + end_col)
+                             for lineno, col, end_lineno, end_col in (site.span,) + site.operands)
+        ranges = []
+        for lineno, col, end_lineno, end_col in site.gaps:
+            start, end = starts[lineno] + col, starts[end_lineno] + end_col
+            if site.gaps == (site.span,):
+                ranges.append((start, end))
+            else:
+                symbol = SYMBOLS[site.original].encode()
+                token = start + findToken(source[start:end], symbol)
+                ranges.append((token, token + len(symbol)))
+        table.append((tuple(ranges), brackets))
+    return table
+
+
+def spliceEdits(splice_table, mutations):
+    """The (start, end, text) byte edits that turn the original source into a mutant, in order and
+    not overlapping. A site nested inside another mutated site loses to the outer one, same as
+    applyMutations."""
+    patches, brackets = [], []
+    for m in mutations:
+        ranges, site_brackets = splice_table[m.site_id]
+        text = SYMBOLS[m.replacement].encode()
+        patches.extend((start, end, text) for start, end in ranges)
+        if PRECEDENCE.get(m.original) != PRECEDENCE.get(m.replacement):
+            brackets.extend(site_brackets)
+    patches.sort(key=lambda patch: (patch[0], -patch[1]))
+    kept, pos = [], 0
+    for start, end, text in patches:
+        if start >= pos:    # otherwise it's inside a patch we already made
+            kept.append((start, 2, end, text))
+            pos = end
+    # brackets go in as they are, unless what they'd go around got replaced wholesale
+    for start, end in brackets:
+        if not any(patch_start <= start and end <= patch_end for patch_start, _, patch_end, _ in kept):
+            kept.append((start, 1, start, b"("))
+            kept.append((end, 0, end, b")"))
+    # where they meet: closing brackets, then opening ones, then the replacements starting there
+    kept.sort(key=lambda edit: (edit[0], edit[1]))
+    return [(start, end, text) for start, _, end, text in kept]
+
+
+def applyEdits(source, edits):
+    out, pos = [], 0
+    for start, end, text in edits:
+        out.append(source[pos:start])
+        out.append(text)
+        pos = end
+    out.append(source[pos:])
+    return b"".join(out)
+
+
+def spliceMutant(source, splice_table, mutations):
+    """Produce a mutant's source by slicing the replacement text straight into the original,
+    instead of regenerating the whole file with astor. Formatting, comments and docstrings
+    survive untouched."""
+    return applyEdits(source, spliceEdits(splice_table, mutations)).decode("utf-8")
+
+
+# A bundle is every mutant of one run in a single file instead of thousands of <n>.py: a header
+# (magic, sha256 and length of the original source), then one record per mutant, appended as they
+# are made. A record is its length, its number of edits, and per edit start, end and the text that
+# goes there (see spliceEdits). All little endian.
+BUNDLE_MAGIC = b"MUTB1\n"
+BUNDLE_HEADER = struct.Struct("<6s32sQ")
+RECORD_HEADER = struct.Struct("<IH")
+EDIT_HEADER = struct.Struct("<IIH")
+
+
+def openBundle(path, source):
+    "Start a new bundle for mutants of source at path (anything already there goes) and return it for appending."
+    out = open(path, "wb")
+    out.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, hashlib.sha256(source).digest(), len(source)))
+    return out
+
+
+def appendMutant(bundle, edits):
+    body = b"".join(EDIT_HEADER.pack(start, end, len(text)) + text for start, end, text in edits)
+    bundle.write(RECORD_HEADER.pack(len(body), len(edits)) + body)
+
+
+class MutantBundle:
+    """Read side of a bundle. The file is mmapped and indexed once by hopping from one record
+    length to the next, after that mutant k is a slice at a known offset, no filesystem involved."""
+
+    def __init__(self, path):
+        with open(path, "rb") as src:
+            self.data = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.source_hash, self.source_length = BUNDLE_HEADER.unpack_from(self.data)
+        if magic != BUNDLE_MAGIC:
+            raise ValueError("%s is not a mutant bundle" % path)
+        self.offsets = []
+        pos = BUNDLE_HEADER.size
+        # a record cut short (mutate.py still writing, or killed) is left out
+        while pos + RECORD_HEADER.size <= len(self.data):
+            length, _ = RECORD_HEADER.unpack_from(self.data, pos)
+            if pos + RECORD_HEADER.size + length > len(self.data):
+                break
+            self.offsets.append(pos)
+            pos += RECORD_HEADER.size + length
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def matches(self, source):
+        "Whether source is what the mutants were made from."
+        return len(source) == self.source_length and hashlib.sha256(source).digest() == self.source_hash
+
+    def edits(self, k):
+        pos = self.offsets[k]
+        _, count = RECORD_HEADER.unpack_from(self.data, pos)
+        pos += RECORD_HEADER.size
+        edits = []
+        for _ in range(count):
+            start, end, length = EDIT_HEADER.unpack_from(self.data, pos)
+            pos += EDIT_HEADER.size
+            edits.append((start, end, self.data[pos:pos + length]))
+            pos += length
+        return edits
+
+    def mutant(self, k, source):
+        "Mutant k's source, as bytes, given the original source."
+        return applyEdits(source, self.edits(k))
 
 
 def main(args):
     "Parse command line, return errors if necessary, and call mutationChamber."
     num_mutants, filename, tree = None, None, None
+    args, options = parseOptions(args)
     if len(args) == 3:
         try:
             filename = args[1]
             num_mutants = int(args[2])
+            jobs = int(options.get("jobs", 1))
+            seed = int(options.get("seed", num_mutants))
         except ValueError:
-            print('Second argument is not an integer')
+            print('Number of mutants, --jobs and --seed must be integers')
             printUsage()
     else:
         printUsage()
 
-    with open(filename, "r") as src:
-        tree = ast.parse(src.read())
-        random.seed(num_mutants)
+    if os.path.isdir(filename):
+        if options.get("coverage"):
+            print("--coverage only works on a single file")
+            return
+        mutatePackage(filename, num_mutants, splice=bool(options.get("splice")), jobs=jobs, seed=seed,
+                      tce=bool(options.get("tce")), plan=planOption(options), bundle=options.get("bundle"),
+                      cache=ParseCache(options.get("cache", ".mutate_cache")), ignore=options.get("ignore"))
+        return
+
+    with open(filename, "rb") as src:
+        source = src.read()
+        tree = ast.parse(source)
     
-    treesize = tree_size(tree)
+    coverage = None
+    if options.get("coverage"):
+        from mutant_runner import recordCoverage
+        coverage = recordCoverage(filename, options["coverage"])
+
+    treesize = annotateTree(tree).size[tree]
     print("Tree size: ", treesize)
-    mutationChamber(tree, num_mutants)
+    mutationChamber(tree, num_mutants, source=source if options.get("splice") or options.get("bundle") else None,
+                    jobs=jobs, seed=seed, tce=bool(options.get("tce")), coverage=coverage, plan=planOption(options),
+                    bundle=options.get("bundle"))
 
-def mutationChamber(tree, num_mutants):
-    """I will mootate you. I will mootate you all."""
-    ctr = FunctionCounter()
-    ctr.visit(tree)
-    treeData = ctr.getTreeData()
-    treeData["call_count"] = sorted(treeData["call_count"].items(), key=lambda x: x[1], reverse=True)
-    pprint(treeData)
-    #breakpoint()
+
+def planOption(options):
+    "generateMutants' plan, from --exhaustive / --stratified."
+    return "exhaustive" if options.get("exhaustive") else "stratified" if options.get("stratified") else "calls"
+
+
+def parseOptions(args):
+    "Pull --name / --name=value options out of args, everything else stays positional."
+    positional, options = [], {}
+    for arg in args:
+        if arg.startswith("--"):
+            name, _, value = arg[2:].partition("=")
+            options[name] = value or True
+        else:
+            positional.append(arg)
+    return positional, options
+
+
+def mutantRng(seed, index):
+    """Private RNG for mutant number index. Mutant k comes out the same no matter which
+    process builds it or how many came before it in that process."""
+    return random.Random("%d:%d" % (seed, index))
+
+
+def planMutants(treeData, sites, num_mutants, seed):
+    """Decide which mutations make up each mutant, yielding (index, mutations).
+    This part is cheap and stays serial, so duplicates are caught in a fixed order;
+    building and writing the mutants is what gets farmed out."""
+    sites_by_func = {}
+    for site_id, site in enumerate(sites):
+        sites_by_func.setdefault(site.func, []).append(site_id)
     mutants_so_far = 0
     current_max_mutations = 1
-    old_mutants = []
-    #breakpoint()
-    while(mutants_so_far < num_mutants):
+    rng = mutantRng(seed, mutants_so_far)
+    pool = MutantPool()
+    # once we ask for more mutations than the biggest function has sites, nothing new can come out
+    most_sites = max((len(sites_by_func.get(func_name, [])) for func_name, call_count in treeData["call_count"] if call_count > 2), default=0)
+    while(mutants_so_far < num_mutants and current_max_mutations <= most_sites):
         for(func_name, call_count) in treeData["call_count"]:
             if(mutants_so_far >= num_mutants):
                         break
@@ -270,35 +739,451 @@ def mutationChamber(tree, num_mutants):
             until we loop through all functions and go back to mutating the second node of the first.
             We will use autograder to compare results from each strategy."""
             # TODO: RIGHT NOW WE ARE MUTATING ALL LINES OF EACH FUNCTION BEFORE GOING TO THE NEXT FUNCTION
-            if(call_count > 2):
-                for i in range(treeData["func_tree_size"][func_name]):
-                    mutator = NodeFinder(func_name, random.randint(1, treeData["func_tree_size"][func_name]), current_max_mutations, mutants_so_far)
-                    mutant_tree = deepcopy(tree)
-                    #breakpoint()
-                    mutant_tree = mutator.visit(mutant_tree)
-                    mutant_src = astor.to_source(mutant_tree) # ast.unparse(mutant_tree) 
-                    if(mutant_tree != tree and mutant_tree not in old_mutants):
-                        with open(str(mutants_so_far) + ".py", "w") as mutant:
-                            mutant.write(mutant_src)
-                            old_mutants.append(mutant_tree)
+            func_sites = sites_by_func.get(func_name, [])
+            if(call_count > 2 and func_sites):
+                for i in range(len(func_sites)):
+                    chosen = rng.sample(func_sites, min(current_max_mutations, len(func_sites)))
+                    mutations = pickMutations(sites, chosen)
+                    # every site changes something, so the only thing to rule out is a repeat
+                    if pool.add(mutations):
+                        yield mutants_so_far, mutations
                         mutants_so_far += 1
+                        rng = mutantRng(seed, mutants_so_far)
                     if(mutants_so_far >= num_mutants):
                         break
                 #breakpoint()
         current_max_mutations += 1
-    #breakpoint()
-        #mutator = MutationChamber(i)
-        #mutant_tree = mutator.visit(deepcopy(tree))
-        #mutant_src = ast.unparse(mutant_tree)
-       
-    return
+
+
+def planExhaustive(enumerator, num_mutants, seed):
+    """planMutants for --exhaustive: every first-order mutant in enumerator order when num_mutants
+    covers them all, otherwise all of them in a seeded shuffle, so the first num_mutants are a
+    fair sample and the rest are there for the tce filter to fall back on. Nothing is ever retried."""
+    order = range(len(enumerator))
+    if num_mutants < len(enumerator):
+        order = list(order)
+        mutantRng(seed, 0).shuffle(order)
+    for index, k in enumerate(order):
+        yield index, enumerator[k]
+
+
+def apportion(count, weights, capacities):
+    """Split count between strata in proportion to weights (largest remainder, integers only, so
+    it's exact for any count), never giving a stratum more than its capacity; what doesn't fit
+    goes to the rest. Returns {stratum: quota}."""
+    quotas = dict.fromkeys(weights, 0)
+    open_strata = [stratum for stratum in weights if capacities[stratum] > 0]
+    while count > 0 and open_strata:
+        total = sum(weights[stratum] for stratum in open_strata)
+        shares = {stratum: count * weights[stratum] // total for stratum in open_strata}
+        short = count - sum(shares.values())
+        for stratum in sorted(open_strata, key=lambda stratum: -(count * weights[stratum] % total))[:short]:
+            shares[stratum] += 1
+        for stratum in open_strata:
+            given = min(shares[stratum], capacities[stratum] - quotas[stratum])
+            quotas[stratum] += given
+            count -= given
+        open_strata = [stratum for stratum in open_strata if quotas[stratum] < capacities[stratum]]
+    return quotas
+
+
+def distinctRanks(rng, size):
+    """Every number in range(size) once, in random order, O(1) each however big size is:
+    a Fisher-Yates shuffle that only remembers the swaps it has made so far."""
+    swapped = {}
+    for i in range(size):
+        j = rng.randrange(i, size)
+        yield swapped.get(j, j)
+        swapped[j] = swapped.get(i, i)
+        swapped.pop(i, None)
+
+
+def unrankCombination(rank, n, k):
+    "The rank-th k-subset of range(n), in lexicographic order."
+    chosen, x = [], 0
+    for left in range(k, 0, -1):
+        while math.comb(n - x - 1, left - 1) <= rank:
+            rank -= math.comb(n - x - 1, left - 1)
+            x += 1
+        chosen.append(x)
+        x += 1
+    return chosen
+
+
+def sampleMutants(treeData, sites, num_mutants, seed):
+    """Plan num_mutants distinct mutants without trial and error, yielding (index, mutations)
+    like planMutants. Functions are strata, weighted by how often the module calls them (plus
+    one, so the entry points the tests call still get some); each stratum gets its share of
+    first-order mutants, and only once a stratum has none left does its share spill over to the
+    others, then to second-order mutants, and so on. Every k-site mutant of a function is a rank
+    in range(comb(sites, k)) drawn without replacement, so each draw is new. The only repeats
+    possible are sites swallowed by a Pass site picked with them, which MutantPool catches.
+    Keeps going past num_mutants while there's anything left, for the tce filter."""
+    rng = mutantRng(seed, 0)
+    sites_by_func = {}
+    for site_id, site in enumerate(sites):
+        sites_by_func.setdefault(site.func, []).append(site_id)
+    call_count = dict(treeData["call_count"])
+    weights = {func: call_count.get(func, 0) + 1 for func in sites_by_func}
+    strata = sorted(sites_by_func, key=lambda func: (-weights[func], sites_by_func[func][0]))
+    pool = MutantPool()
+    index = 0
+    for order in range(1, max((len(func_sites) for func_sites in sites_by_func.values()), default=0) + 1):
+        sizes = {func: math.comb(len(sites_by_func[func]), order) for func in strata}
+        ranks = {func: distinctRanks(rng, sizes[func]) for func in strata}
+        used = dict.fromkeys(strata, 0)
+        while True:
+            capacities = {func: sizes[func] - used[func] for func in strata}
+            # past num_mutants, more of the same mix, in case the tce filter throws some away
+            quotas = apportion(num_mutants - index if index < num_mutants else num_mutants, weights, capacities)
+            if not any(quotas.values()):
+                break
+            # round robin, so whoever stops early still gets every function's share so far
+            for turn in range(max(quotas.values())):
+                for func in strata:
+                    if turn < quotas[func]:
+                        used[func] += 1
+                        chosen = unrankCombination(next(ranks[func]), len(sites_by_func[func]), order)
+                        mutations = pickMutations(sites, [sites_by_func[func][i] for i in chosen])
+                        if pool.add(mutations):
+                            yield index, mutations
+                            index += 1
+
+
+def codeKey(code):
+    """Everything about a code object that decides what it does, nested functions included,
+    minus line numbers and file names. Two mutants with the same key are the same program
+    as far as the compiler is concerned (trivial compiler equivalence)."""
+    consts = tuple(codeKey(const) if isinstance(const, types.CodeType) else (type(const).__name__, repr(const))
+                   for const in code.co_consts)
+    return (code.co_code, consts, code.co_names, code.co_varnames, code.co_freevars, code.co_cellvars,
+            # no exception table before 3.11, the try blocks were in the bytecode itself
+            code.co_argcount, code.co_kwonlyargcount, code.co_flags, getattr(code, "co_exceptiontable", b""))
+
+
+def compiledKey(mutant_src):
+    "codeKey of a whole module's source, or None if it doesn't compile."
+    try:
+        return codeKey(compile(mutant_src, "<mutant>", "exec"))
+    except (SyntaxError, ValueError):
+        return None
+
+
+def compiles(mutant_src):
+    try:
+        compile(mutant_src, "<mutant>", "exec")
+    except (SyntaxError, ValueError):
+        return False
+    return True
+
+
+# what emitMutant works from, set once per process by initEmitter
+emitter = {}
+
+def initEmitter(tree, sites, source, splice_table, tce=False, edits=False):
+    emitter.update(tree=tree, sites=sites, source=source, splice_table=splice_table, tce=tce, edits=edits)
+
+def emitMutant(planned):
+    """Build one planned mutant. Nothing is written here: the source (and with tce its codeKey)
+    goes back so the parent can throw out equivalent mutants and number the survivors before they
+    ever hit the disk, or hand them straight to a test runner. With edits on, what goes back
+    instead of the source is its spliceEdits, for a bundle. Returns (index, source or edits, key),
+    or None if the mutant doesn't compile: it would only die at import, and look killed without a
+    single test having run."""
+    index, mutations = planned
+    if emitter["edits"]:
+        edits = spliceEdits(emitter["splice_table"], mutations)
+        mutant_src = applyEdits(emitter["source"], edits)
+    elif emitter["source"] is not None:
+        mutant_src = spliceMutant(emitter["source"], emitter["splice_table"], mutations)
+    else:
+        mutant_src = astor.to_source(materializeMutant(emitter["tree"], emitter["sites"], mutations)) # ast.unparse(mutant_tree) 
+    key = None
+    if emitter["tce"]:
+        key = compiledKey(mutant_src)
+        if key is None:
+            return None
+    elif not compiles(mutant_src):
+        return None
+    return index, edits if emitter["edits"] else mutant_src, key
+
+def writeMutant(number, mutant_src):
+    with open(str(number) + ".py", "w") as mutant:
+        mutant.write(mutant_src)
+
+
+def describeMutant(sites, mutations, keys):
+    """What went into a mutant, for mutants.json. The test runner uses funcs to know what the mutant
+    touched, and key (see siteKeys) to find results it already has for the same mutation."""
+    return {"funcs": sorted({sites[m.site_id].func for m in mutations}),
+            "mutations": [{"site": m.site_id, "func": sites[m.site_id].func, "kind": sites[m.site_id].kind,
+                           "line": sites[m.site_id].span[0], "original": m.original, "replacement": m.replacement,
+                           "key": "%s:%s>%s" % (keys[m.site_id], m.original, m.replacement)}
+                          for m in mutations]}
+
+
+def analyzeTree(tree):
+    """Everything generateMutants works out from the tree: call counts (most called first), the
+    site table and siteKeys. All plain data, so unlike the tree it pickles and unpickles fast."""
+    ctr = FunctionCounter()
+    ctr.visit(tree)
+    treeData = ctr.getTreeData()
+    treeData["call_count"] = sorted(treeData["call_count"].items(), key=lambda x: x[1], reverse=True)
+    sites = buildSiteTable(tree)
+    return treeData, sites, siteKeys(tree, sites)
+
+
+def generateMutants(tree, num_mutants, source=None, jobs=1, seed=0, tce=False, coverage=None,
+                   out=sys.stdout, plan="calls", edits=False, analysis=None):
+    """Yield (number, source, description) for each mutant as soon as it's built, description being
+    its mutants.json entry. Numbers run 0..num_mutants-1 with no gaps, whatever got dropped on the
+    way. With edits on (which needs source) what comes instead of the mutant's source is its
+    spliceEdits. Only one batch of the plan is ever held at a time, so this can
+    feed a test runner directly for any number of mutants. What it finds out about the target along
+    the way gets printed to out. plan picks the mutants: "calls" is planMutants, "exhaustive"
+    planExhaustive and "stratified" sampleMutants. analysis is analyzeTree(tree) if that's already
+    been done (see loadModules); then tree is only needed when there's no source to splice into."""
+    treeData, sites, keys = analysis if analysis is not None else analyzeTree(tree)
+    pprint(treeData, stream=out)
+    print("Mutation sites: ", len(sites), file=out)
+    if coverage is not None:
+        hits = siteHits(sites, coverage)
+        if sites and not any(hits):
+            # far likelier the recording broke than that the tests really never touch the target
+            print("WARNING: coverage says the tests reach none of the mutation sites; not trusting it, keeping them all",
+                  file=sys.stderr)
+        else:
+            keys = [key for key, count in zip(keys, hits) if count]
+            sites = [site for site, count in zip(sites, hits) if count]
+            print("Mutation sites the tests reach: ", len(sites), file=out)
+    splice_table = buildSpliceTable(source, sites) if source is not None else None
+    if plan == "exhaustive":
+        enumerator = MutantEnumerator(sites)
+        print("First-order mutants: ", len(enumerator), file=out)
+        plan = planExhaustive(enumerator, num_mutants, seed)
+    elif plan == "stratified":
+        plan = sampleMutants(treeData, sites, num_mutants, seed)
+    else:
+        # mutants that don't compile (and with tce, equivalent ones) get dropped, so keep planning
+        # until we have enough; the batches below never take more than can be used
+        plan = planMutants(treeData, sites, sys.maxsize, seed)
+    emitter_args = (tree, sites, source, splice_table, tce, edits)
+    initEmitter(*emitter_args)
+    workers = multiprocessing.Pool(jobs, initializer=initEmitter, initargs=emitter_args) if jobs > 1 else None
+    seen_keys = {compiledKey(source if source is not None else astor.to_source(tree))}
+    mutants_so_far, dropped, invalid = 0, 0, 0
+    try:
+        while(mutants_so_far < num_mutants):
+            # in batches, so the pool is never handed more of the plan than we are going to use
+            # (plans can run on past num_mutants; with tce enough get dropped that bigger batches pay)
+            batch = list(islice(plan, jobs * 8 if tce else min(jobs * 8, num_mutants - mutants_so_far)))
+            if not batch:
+                break
+            built = workers.map(emitMutant, batch) if workers else map(emitMutant, batch)
+            for (index, mutations), emitted in zip(batch, built):
+                if(mutants_so_far >= num_mutants):
+                    break
+                if emitted is None:
+                    invalid += 1
+                    continue
+                _, mutant_src, key = emitted
+                if tce:
+                    if key in seen_keys:
+                        dropped += 1
+                        continue
+                    seen_keys.add(key)
+                yield mutants_so_far, mutant_src, describeMutant(sites, mutations, keys)
+                mutants_so_far += 1
+    finally:
+        if workers:
+            workers.terminate()
+    if tce:
+        print("Equivalent mutants dropped: ", dropped, file=out)
+    if invalid:
+        print("Mutants that didn't compile, replaced: ", invalid, file=out)
+
+
+def mutationChamber(tree, num_mutants, source=None, jobs=1, seed=0, tce=False, coverage=None, plan="calls",
+                    bundle=None, analysis=None):
+    """I will mootate you. I will mootate you all.
+    Give it the original source (bytes) and mutants get spliced into it instead of going through astor.
+    With jobs > 1 the mutants are built by a pool of worker processes; the output
+    is the same as with one job for the same seed.
+    With tce, mutants that compile to the same bytecode as the original or as a mutant we already
+    kept are dropped (and replaced) before anything is written.
+    coverage is what mutant_runner.recordCoverage returned; sites the tests never run are skipped
+    since no test could ever kill a mutant there.
+    plan is how the mutants are picked, see generateMutants.
+    With bundle (a path) the mutants all go into that one file as splice edits (so source is
+    needed) instead of into <n>.py files; mutants.json still names them <n>.py.
+    Returns how many mutants it made, which can be fewer than num_mutants when the plan runs dry."""
+    manifest = {}
+    bundle_out = openBundle(bundle, source) if bundle else None
+    try:
+        for number, mutant, description in generateMutants(tree, num_mutants, source, jobs, seed, tce, coverage,
+                                                           plan=plan, edits=bool(bundle), analysis=analysis):
+            if bundle_out:
+                appendMutant(bundle_out, mutant)
+            else:
+                writeMutant(number, mutant)
+            manifest[str(number) + ".py"] = description
+    finally:
+        if bundle_out:
+            bundle_out.close()
+    with open("mutants.json", "w") as out:
+        json.dump(manifest, out, indent=1)
+    return len(manifest)
+
+
+# bump whenever what analyzeTree returns changes shape, so old cache entries stop matching
+CACHE_VERSION = 2
+
+
+class ParseCache:
+    """analyzeTree of every file parsed before, pickled to one file each under directory. Not the
+    ast itself: unpickling one takes longer than ast.parse. An entry is only used while the file's
+    path, mtime and sha256 all still match, and the Python version too (what parses, and so what
+    the site table holds, changes between versions). The stamp is pickled ahead of the rest, so a
+    stale entry costs one small read."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def entryPath(self, path):
+        return os.path.join(self.directory, hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:32] + ".pickle")
+
+    def stamp(self, path, source):
+        return (CACHE_VERSION, tuple(sys.version_info[:2]), os.path.abspath(path), os.stat(path).st_mtime_ns,
+                hashlib.sha256(source).hexdigest())
+
+    def get(self, path, source):
+        "The analysis for path if the entry is still good, otherwise None."
+        try:
+            with open(self.entryPath(path), "rb") as src:
+                if pickle.load(src) != self.stamp(path, source):
+                    return None
+                treeData, sites, keys = pickle.load(src)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+            return None
+        return treeData, [MutationSite(*site) for site in sites], keys
+
+    def put(self, path, source, analysis):
+        entry = self.entryPath(path)
+        # written aside and moved into place, so a reader never sees half an entry
+        with open(entry + ".%d" % os.getpid(), "wb") as out:
+            pickle.dump(self.stamp(path, source), out, pickle.HIGHEST_PROTOCOL)
+            # sites as plain tuples: pickled as they are, they'd only load back into whichever module
+            # pickled them, and that's __main__ when mutate.py is run as a script
+            treeData, sites, keys = analysis
+            pickle.dump((treeData, [tuple(site) for site in sites], keys), out, pickle.HIGHEST_PROTOCOL)
+        os.replace(entry + ".%d" % os.getpid(), entry)
+
+
+def analyzeModule(path):
+    "analyzeTree for one file, or None if it doesn't parse."
+    with open(path, "rb") as src:
+        source = src.read()
+    try:
+        return analyzeTree(ast.parse(source, filename=path))
+    except (SyntaxError, ValueError):
+        return None
+
+
+def loadModules(paths, jobs=1, cache=None):
+    """(path, source, analysis) for every path that parses, in order. Whatever the cache doesn't
+    have gets parsed and analyzed by jobs worker processes, and then cached."""
+    loaded, missing = {}, []
+    for path in paths:
+        with open(path, "rb") as src:
+            source = src.read()
+        hit = cache.get(path, source) if cache else None
+        if hit:
+            loaded[path] = (source, hit)
+        else:
+            missing.append((path, source))
+    if missing:
+        if jobs > 1 and len(missing) > 1:
+            with multiprocessing.Pool(jobs) as workers:
+                analyzed = workers.map(analyzeModule, [path for path, _ in missing])
+        else:
+            analyzed = map(analyzeModule, [path for path, _ in missing])
+        for (path, source), analysis in zip(missing, analyzed):
+            if analysis is None:
+                print("Can't parse %s, skipping it" % path)
+                continue
+            loaded[path] = (source, analysis)
+            if cache:
+                cache.put(path, source, analysis)
+    return [(path,) + loaded[path] for path in paths if path in loaded]
+
+
+def mutatePackage(directory, num_mutants, splice=False, jobs=1, seed=0, tce=False, plan="calls", bundle=None,
+                  cache=None, ignore=None):
+    """mutationChamber over every .py file under directory (found the way astor finds them; ignore
+    skips any directory whose path contains it). num_mutants is split between the files in
+    proportion to how many sites each has, and each file's mutants and mutants.json go in a
+    directory of their own named after the module (sub/mod.py -> sub.mod/). A file that can't
+    make its share (the default plan only mutates functions called more than twice) leaves what's
+    missing to the files after it. campaign.json says which directory holds which file's mutants,
+    and how many it actually got."""
+    paths = sorted(os.path.join(srcpath, fname) for srcpath, fname in CodeToAst.find_py_files(directory, ignore))
+    modules = loadModules(paths, jobs, cache)
+    quotas = apportion(num_mutants, {path: len(analysis[1]) for path, _, analysis in modules},
+                       {path: num_mutants if analysis[1] else 0 for path, _, analysis in modules})
+    campaign = {}
+    for position, (path, source, analysis) in enumerate(modules):
+        if not quotas[path]:
+            continue
+        name = os.path.splitext(os.path.relpath(path, directory))[0].replace(os.sep, ".")
+        print("%s: %d sites, %d mutants in %s/" % (path, len(analysis[1]), quotas[path], name))
+        # astor needs the tree to regenerate mutants from, splicing doesn't
+        tree = None if splice or bundle else ast.parse(source, filename=path)
+        campaign[name] = {"file": os.path.abspath(path), "mutants": quotas[path]}
+        os.makedirs(name, exist_ok=True)
+        # mutationChamber (and its workers) write to the current directory
+        cwd = os.getcwd()
+        os.chdir(name)
+        try:
+            made = mutationChamber(tree, quotas[path], source if splice or bundle else None, jobs, seed, tce,
+                                   plan=plan, bundle=bundle, analysis=analysis)
+        finally:
+            os.chdir(cwd)
+        campaign[name]["mutants"] = made
+        if made < quotas[path]:
+            rest = [(later, len(later_analysis[1])) for later, _, later_analysis in modules[position + 1:]]
+            extra = apportion(quotas[path] - made, dict(rest), {later: num_mutants if sites else 0 for later, sites in rest})
+            print("%s: only %d mutants%s" % (path, made, ", %d go to the files after it" % sum(extra.values())
+                                                  if any(extra.values()) else ""))
+            for later, more in extra.items():
+                quotas[later] += more
+    total = sum(entry["mutants"] for entry in campaign.values())
+    if total < num_mutants:
+        print("Made %d of the %d mutants asked for" % (total, num_mutants))
+    with open("campaign.json", "w") as out:
+        json.dump(campaign, out, indent=1)
 
 
 def printUsage():
-    print("USAGE: mutate.py <filename> <number of mutants>")
+    print("USAGE: mutate.py <filename> <number of mutants> [--splice] [--jobs=N] [--seed=S] [--tce] [--coverage=TESTFILE]")
+    print("                 [--exhaustive | --stratified] [--bundle=FILE]")
+    print("       mutate.py <directory> <number of mutants> [--cache=DIR] [--ignore=STR] [same options, bar --coverage]")
+    print("  a directory gets every .py file under it mutated, the mutants split between them by number of sites,")
+    print("  each file's going to a directory named after the module; campaign.json lists them")
+    print("  --splice  splice each mutation into the original source instead of regenerating it with astor")
+    print("  --jobs    build and write mutants with N worker processes")
+    print("  --seed    seed for picking mutants, defaults to the number of mutants")
+    print("  --tce     drop mutants that compile to the same bytecode as the original or an earlier mutant")
+    print("  --coverage  run TESTFILE once under tracing and skip sites it never executes")
+    print("  --exhaustive  every first-order mutant with every replacement, each once; a seeded sample of them")
+    print("                if there are more than the number asked for")
+    print("  --stratified  sample distinct mutants across all functions, weighted by call count, first-order")
+    print("                ones first, without the retries of the default plan")
+    print("  --bundle  put every mutant in FILE as spliced edits instead of writing <n>.py files")
+    print("            (mutant_runner.py --bundle=FILE reads them back)")
+    print("  --cache   where parsed files are kept between runs over a directory (default .mutate_cache)")
+    print("  --ignore  skip directories whose path contains STR")
 
         
 if __name__ == "__main__":
     main(sys.argv)
-
-
@@ -2,18 +2,14 @@ import ast
 from pprint import pprint
 import sys
 import random
-from copy import deepcopy
+import hashlib
+from copy import deepcopy, copy
 import astor
-
-def tree_size(node):
-    return 1 + sum(tree_size(child) for child in ast.iter_child_nodes(node))
+from mutate import annotateTree, compiles, copyForFunction, tree_size
 
 def height(node):
-    if isinstance(node, ast.AST):
-        children = list(ast.iter_child_nodes(node))
-        if children:
-            return 1 + max(height(child) for child in children)
-    return 0
+    return annotateTree(node).height[node]
+
 
 class FunctionCounter(ast.NodeVisitor):
     def __init__(self):
@@ -21,6 +17,11 @@ class FunctionCounter(ast.NodeVisitor):
         self.function_tree_size = {}
         self.function_defs = set()
         self.num_defs = 0
+        self.metrics = None
+
+    def visit_Module(self, node):
+        self.metrics = annotateTree(node)
+        self.generic_visit(node)
     
     def visit_Call(self, node):
         if isinstance(node.func, ast.Name):
@@ -28,7 +29,7 @@ class FunctionCounter(ast.NodeVisitor):
                 self.function_call_count[node.func.id] += 1
             else:
                 self.function_call_count[node.func.id] = 1
-                self.function_tree_size[node.func.id] = tree_size(node)
+                self.function_tree_size[node.func.id] = self.metrics.size[node] if self.metrics else tree_size(node)
         # special key that is number of definitions, 
         # has a space so it never gets overwritten by a function name
         
@@ -39,7 +40,7 @@ class FunctionCounter(ast.NodeVisitor):
         self.function_defs.add(node.name)
         self.num_defs += 1
         print("Visiting definition of ", node.name)
-        print(height(node))
+        print(self.metrics.height[node] if self.metrics else height(node))
         self.generic_visit(node)
 
 
@@ -59,22 +60,27 @@ class NodeFinder(ast.NodeTransformer):
 
     def visit_FunctionDef(self, node):
         if node.name == self.func_to_mutate:
-            mutator = MutationChamber(mutants_so_far=self.mutants_so_far, dont_mutate_until=self.dont_mutate_until, func_tree_height=height(node), max_mutations=self.max_mutations, 
-                                      mutation_depth=(height(node) - self.mutation_depth))
+            metrics = annotateTree(node)
+            mutator = MutationChamber(mutants_so_far=self.mutants_so_far, dont_mutate_until=self.dont_mutate_until, func_tree_height=metrics.height[node], max_mutations=self.max_mutations, 
+                                      mutation_depth=(metrics.height[node] - self.mutation_depth), metrics=metrics)
             node = mutator.visit(node)
         #print(node)
         #breakpoint()
         return node
 
 class MutationChamber(ast.NodeTransformer):
-    def __init__(self, mutants_so_far, dont_mutate_until: int, func_tree_height, max_mutations: int = 1, mutation_depth=-1, ):
+    def __init__(self, mutants_so_far, dont_mutate_until: int, func_tree_height, max_mutations: int = 1, mutation_depth=-1, metrics=None):
         self.num_mutations = 0
         self.dont_mutate_until = dont_mutate_until
         self.nodes_so_far = 0
         self.max_mutations = max_mutations
         self.mutants_so_far = mutants_so_far
+        # the call that is the whole of the statement being visited, the only kind that can become pass
+        self.statement_call = None
         self.mutation_depth = mutation_depth
         self.func_tree_height = func_tree_height
+        # annotateTree of the def we're in, so a node's height is a lookup and not another walk
+        self.metrics = metrics
         # SECOND IDEA: we could just mutate the first node for the first mutant, 
         # the second node for the second mutant, etc.
 
@@ -84,15 +90,20 @@ class MutationChamber(ast.NodeTransformer):
 
         # LAST IDEA AND THE FIRST ONE WE'LL TRY: 
         # Randomly decide whether to mutate each node as we look at it using random.choice([True, False])random.choice([True, False]) and num_mutations < 2, setting random.seed(num_mutants) at the start of the program.
+    def nodeHeight(self, node):
+        if self.metrics is not None and node in self.metrics.height:
+            return self.metrics.height[node]
+        return height(node)
+
     def shouldMutate(self, node):
-        return self.dont_mutate_until >= self.nodes_so_far and self.num_mutations < self.max_mutations and self.mutation_depth == self.func_tree_height - height(node) and random.choice([True, False])
+        return self.dont_mutate_until >= self.nodes_so_far and self.num_mutations < self.max_mutations and self.mutation_depth == self.func_tree_height - self.nodeHeight(node) and random.choice([True, False])
 
     def printMutating(self, node):
         print("Mutating node: ", ast.dump(node))
         print("Height of tree: ", self.func_tree_height)
-        print("Height of node: ", height(node))
-        print("Height of tree minus height of node: ", self.func_tree_height - height(node))
-        print("CORRECT DEPTH MUTATED: ", self.func_tree_height - height(node) == self.mutation_depth)
+        print("Height of node: ", self.nodeHeight(node))
+        print("Height of tree minus height of node: ", self.func_tree_height - self.nodeHeight(node))
+        print("CORRECT DEPTH MUTATED: ", self.func_tree_height - self.nodeHeight(node) == self.mutation_depth)
         print("Mutating at node number: ", self.nodes_so_far)
         print("Mutating at mutation number: ", self.num_mutations)
         print("\n")
@@ -231,8 +242,17 @@ class MutationChamber(ast.NodeTransformer):
         return node
 
 
+    def visit_Expr(self, node):
+        self.statement_call = node.value
+        self.generic_visit(node)
+        # the statement goes rather than leaving a bare pass as its value
+        if isinstance(node.value, ast.Pass):
+            return ast.copy_location(node.value, node)
+        return node
+
     def visit_Call(self, node):
-        if(self.shouldMutate(node)):
+        # anywhere but a statement of its own (return f(x), len(x) > 0) pass wouldn't compile
+        if(node is self.statement_call and self.shouldMutate(node)):
             self.printMutating(node)
             self.nodes_so_far += 1
             self.num_mutations
@@ -273,8 +293,9 @@ def main(args):
         tree = ast.parse(src.read())
         random.seed(num_mutants)
     
-    treesize = tree_size(tree)
-    treeheight = height(tree)
+    metrics = annotateTree(tree)
+    treesize = metrics.size[tree]
+    treeheight = metrics.height[tree]
     print("Tree size: ", treesize)
     print("Tree height: ", treeheight)
    # breakpoint()
@@ -292,7 +313,8 @@ def mutationChamber(tree, num_mutants):
     current_max_mutations = 2
     mutation_depth = 1
     #breakpoint()
-    all_mutant_trees = []
+    # sha1 of every mutant's source: O(1) lookups and no trees kept alive
+    all_mutant_hashes = set()
     duplicates_found = False
     while(mutants_so_far < num_mutants):
         i = 0
@@ -307,21 +329,22 @@ def mutationChamber(tree, num_mutants):
             #if(call_count > 0):
                 #for i in range(treeData["func_tree_size"][func_name]):
             mutator = NodeFinder(func_name, i % 3, current_max_mutations, mutants_so_far, mutation_depth)
-            mutant_tree = deepcopy(tree)
+            mutant_tree = copyForFunction(tree, func_name)
             #print("Mutant tree before visit: ", mutant_tree)
             #breakpoint()
             mutant_tree = mutator.visit(mutant_tree)
             #print("Mutant tree after visit: ", mutant_tree)
             mutant_src = astor.to_source(mutant_tree) # ast.unparse(mutant_tree) 
-            if mutant_tree != tree:
+            # one that doesn't compile would only fail at import and look killed, try the next one instead
+            if mutant_tree != tree and compiles(mutant_src):
                 with open(str(mutants_so_far) + ".py", "w") as mutant:
                     mutant.write(mutant_src)
                     
-                    for trees in all_mutant_trees:
-                        if(trees == mutant_tree):
-                            print("Duplicate tree found!")
-                            duplicates_found = True
-                    all_mutant_trees.append(mutant_tree)
+                    mutant_hash = hashlib.sha1(mutant_src.encode()).digest()
+                    if(mutant_hash in all_mutant_hashes):
+                        print("Duplicate tree found!")
+                        duplicates_found = True
+                    all_mutant_hashes.add(mutant_hash)
                     #del mutant_tree
                 mutants_so_far += 1
                 if(mutants_so_far >= num_mutants):
@@ -2,8 +2,9 @@ import ast
 from pprint import pprint
 import sys
 import random
-from copy import deepcopy
+from copy import deepcopy, copy
 import astor
+from mutate import copyForFunction
 
 def tree_size(node):
     return 1 + sum(tree_size(child) for child in ast.iter_child_nodes(node))
@@ -308,7 +309,7 @@ def mutationChamber(tree, num_mutants):
                 #for i in range(treeData["func_tree_size"][func_name]):
                 if(True): # TODO: the commented out shit above is from the good submit...
                     mutator = NodeFinder(func_name, i, current_max_mutations, mutants_so_far)
-                    mutant_tree = deepcopy(tree)
+                    mutant_tree = copyForFunction(tree, func_name)
                     print("Mutant tree before visit: ", mutant_tree)
                     #breakpoint()
                     mutant_tree = mutator.visit(mutant_tree)
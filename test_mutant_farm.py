@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+from mutant_farm import Coordinator, CoordinatorServer, killMatrix, work
+from mutant_runner import KILLED, SURVIVED, TIMEOUT
+
+# a target small enough to mutate by hand, and a test that kills anything that isn't x * 2
+TARGET = "import os\nimport time\n\n\ndef double(x):\n%s\n"
+TEST = """import unittest
+import farmtarget
+
+
+class DoubleTest(unittest.TestCase):
+    def test_double(self):
+        self.assertEqual(farmtarget.double(2), 4)
+"""
+
+
+def mutant(number, body):
+    return number, TARGET % body, {"funcs": ["double"], "mutations": [{"func": "double", "body": body}]}
+
+
+class FarmTest(unittest.TestCase):
+    """Coordinator and workers on localhost, the workers in processes of their own like they'd
+    be on other boxes."""
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.scratch = scratch.name
+        self.setup = {"target_name": "farmtarget.py", "target": TARGET % "    return x * 2",
+                      "test_name": "farmtarget_test.py", "test": TEST, "timeout": 30.0, "max_memory": 1024 * 1024 * 1024}
+
+    def serve(self, mutants, **options):
+        "A coordinator for mutants listening on a free port. Returns (coordinator, port, reported results)."
+        coordinator = Coordinator(iter(mutants), self.setup, **options)
+        reported = []
+        server = CoordinatorServer(("localhost", 0), coordinator, reported.append)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return coordinator, server.server_address[1], reported
+
+    def startWorker(self, port, name, fork=True):
+        process = multiprocessing.Process(target=work, args=("localhost", port, name, fork), daemon=True)
+        process.start()
+        self.addCleanup(process.join)
+        self.addCleanup(process.kill)
+        return process
+
+    def finish(self, coordinator, limit=60):
+        "What coordinate does until every mutant has a result, but giving up after limit seconds."
+        deadline = time.monotonic() + limit
+        while not coordinator.finished.wait(0.2):
+            coordinator.reap()
+            self.assertLess(time.monotonic(), deadline, "the coordinator never finished")
+        return coordinator.results
+
+    def waitFor(self, condition, limit=30):
+        deadline = time.monotonic() + limit
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "gave up waiting")
+            time.sleep(0.05)
+
+    def test_every_mutant_gets_one_result(self):
+        mutants = [mutant(0, "    return x * 2"), mutant(1, "    return x + 3"), mutant(2, "    return x * 3"),
+                   mutant(3, "    return x - 2"), mutant(4, "    return x ** 2"), mutant(5, "    return -x")]
+        coordinator, port, reported = self.serve(mutants)
+        for name in ("a", "b"):
+            self.startWorker(port, name)
+        results = self.finish(coordinator)
+        self.assertEqual(sorted(results), list(range(6)))
+        self.assertEqual(len(reported), 6)
+        # 2 * 2 == 2 ** 2, so that one gets away too
+        self.assertEqual([results[k]["status"] for k in range(6)], [SURVIVED, KILLED, KILLED, KILLED, SURVIVED, KILLED])
+        matrix = killMatrix(results)
+        self.assertEqual(matrix["tests"], ["farmtarget_test.DoubleTest.test_double"])
+        self.assertEqual(matrix["kills"], [[0], [1], [1], [1], [0], [1]])
+
+    def test_killed_worker_loses_its_lease(self):
+        # the first worker to run mutant 0 leaves a mark and sleeps; the next one finds the mark
+        mark = os.path.join(self.scratch, "mark")
+        sleeper = ("    if not os.path.exists(%r):\n        open(%r, 'w').close()\n        time.sleep(60)\n"
+                   "    return x * 2" % (mark, mark))
+        coordinator, port, reported = self.serve([mutant(0, sleeper), mutant(1, "    return x + 3")])
+        first = self.startWorker(port, "first")
+        self.waitFor(lambda: os.path.exists(mark))
+        os.kill(first.pid, signal.SIGKILL)
+        self.startWorker(port, "second")
+        results = self.finish(coordinator)
+        self.assertEqual(coordinator.attempts[0], 2)
+        self.assertEqual(results[0]["status"], SURVIVED)
+        self.assertEqual(results[1]["status"], KILLED)
+        self.assertEqual(len(reported), 2)
+
+    def test_looping_mutant_times_out_and_worker_carries_on(self):
+        self.setup["timeout"] = 2.0
+        coordinator, port, _ = self.serve([mutant(0, "    while True:\n        pass"), mutant(1, "    return x + 3")])
+        # one worker, so it has to have come through the first to run the second
+        self.startWorker(port, "only")
+        results = self.finish(coordinator, limit=20)
+        self.assertEqual(results[0]["status"], TIMEOUT)
+        self.assertEqual(results[1]["status"], KILLED)
+        self.assertEqual(coordinator.attempts[0], 1)
+
+    def test_no_fork_worker_stuck_for_good_times_out(self):
+        # nothing stops this one, and the worker's heartbeats keep going all the while
+        coordinator, port, _ = self.serve([mutant(0, "    while True:\n        pass")], lease_limit=2)
+        self.startWorker(port, "stuck", fork=False)
+        results = self.finish(coordinator, limit=20)
+        self.assertEqual(results[0]["status"], TIMEOUT)
+        self.assertEqual(coordinator.attempts[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
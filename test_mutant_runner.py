@@ -0,0 +1,44 @@
+import ast
+import os
+import tempfile
+import unittest
+
+from mutate import buildSiteTable, siteHits
+from mutant_runner import recordCoverage
+
+# scale(3) takes the first branch only, and nothing calls unused
+TARGET = """def scale(a, factor=2, flag=True):
+    if a > 0 and flag:
+        return a * factor
+    return a - 1
+
+
+def unused(b):
+    return b + 1 == 3
+"""
+TEST = """import unittest
+import covtarget
+
+
+class ScaleTest(unittest.TestCase):
+    def test_scale(self):
+        self.assertEqual(covtarget.scale(3), 6)
+"""
+
+
+class CoverageTest(unittest.TestCase):
+    def test_sites_the_tests_reach(self):
+        with tempfile.TemporaryDirectory() as scratch:
+            target_path, test_path = os.path.join(scratch, "covtarget.py"), os.path.join(scratch, "covtarget_test.py")
+            for path, text in ((target_path, TARGET), (test_path, TEST)):
+                with open(path, "w") as out:
+                    out.write(text)
+            coverage = recordCoverage(target_path, test_path)
+        sites = buildSiteTable(ast.parse(TARGET))
+        reached = [(site.kind, site.span[0]) for site, hits in zip(sites, siteHits(sites, coverage)) if hits]
+        # the default True only runs as part of the def, and has no instruction of its own on some versions
+        self.assertEqual(reached, [("Constant", 1), ("BoolOp", 2), ("Compare", 2), ("BinOp", 3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
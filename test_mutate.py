@@ -0,0 +1,37 @@
+import ast
+import unittest
+
+from mutate import buildSiteTable, siteKeys
+
+TWINS = """class A:
+    def size(self):
+        return self.n + 1
+
+
+class B:
+    def size(self):
+        return self.n + 1
+
+
+def size(n):
+    return n + 1
+"""
+
+
+class SiteKeysTest(unittest.TestCase):
+    def test_identical_methods_get_different_keys(self):
+        tree = ast.parse(TWINS)
+        keys = siteKeys(tree, buildSiteTable(tree))
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(len(set(keys)), 3)
+        self.assertTrue(keys[0].startswith("A.size:"))
+        self.assertTrue(keys[1].startswith("B.size:"))
+
+    def test_keys_survive_edits_elsewhere(self):
+        tree = ast.parse(TWINS)
+        moved = ast.parse("import os\n\n\n" + TWINS.replace("return n + 1", "return n * 2"))
+        self.assertEqual(siteKeys(tree, buildSiteTable(tree))[:2], siteKeys(moved, buildSiteTable(moved))[:2])
+
+
+if __name__ == "__main__":
+    unittest.main()